@@ -0,0 +1,144 @@
+import argparse
+import atexit
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict, deque
+
+# Load test for the !n pipeline. Submits commands through
+# commands.submit_natural_language_command at a fixed request rate, so they
+# go through the same worker pool, queues and batching as in the server,
+# against nl_backends.FakeBackend in a throwaway data directory. Reports
+# throughput, latency percentiles (submit to commands executed), queue-full
+# rejections and how often the rate limiter turned calls away. Needs no API key.
+#
+#   python3 bench_nl.py --rate 20 --duration 30 --latency 0.8 --error-rate 0.05
+
+
+def _parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark the !n pipeline against a fake model backend.")
+    parser.add_argument("--rate", type=float, default=10.0, help="requests per second (default 10)")
+    parser.add_argument("--duration", type=float, default=20.0, help="seconds to send requests for (default 20)")
+    parser.add_argument("--latency", type=float, default=0.5, help="mean fake model latency in seconds (default 0.5)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of fake model calls that fail (default 0)")
+    parser.add_argument("--users", type=int, default=50, help="distinct users sending requests (default 50)")
+    parser.add_argument("--workers", type=int, default=None, help="override NL_WORKER_THREADS")
+    parser.add_argument("--queue-size", type=int, default=None, help="override NL_QUEUE_SIZE_PER_WORKER")
+    parser.add_argument("--batch-size", type=int, default=None, help="override NL_BATCH_MAX_SIZE")
+    parser.add_argument("--hedging", action="store_true", help="enable hedged requests")
+    parser.add_argument("--repeat-inputs", action="store_true",
+                        help="reuse input shapes so the translation cache can answer (default: every input is new)")
+    parser.add_argument("--no-limits", action="store_true", help="disable the Gemini rate limits")
+    return parser.parse_args()
+
+
+def main():
+    args = _parse_args()
+
+    # data.py works relative to the current directory, so switch to a scratch
+    # one before it is imported. Registered first so it runs after the other
+    # atexit handlers have flushed into it.
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    sys.path.insert(0, script_dir)
+    work_dir = tempfile.mkdtemp(prefix="eckobits-bench-")
+    atexit.register(shutil.rmtree, work_dir, True)
+    os.chdir(work_dir)
+
+    import gemini_config
+    gemini_config.NL_BACKEND = "fake"
+    gemini_config.NL_HEDGING_ENABLED = args.hedging
+    if args.workers is not None:
+        gemini_config.NL_WORKER_THREADS = args.workers
+    if args.queue_size is not None:
+        gemini_config.NL_QUEUE_SIZE_PER_WORKER = args.queue_size
+    if args.batch_size is not None:
+        gemini_config.NL_BATCH_MAX_SIZE = args.batch_size
+    if args.no_limits:
+        for model_name in gemini_config.RATE_LIMITS:
+            gemini_config.RATE_LIMITS[model_name] = (float("inf"), float("inf"), float("inf"))
+
+    import commands
+    import metrics
+    import nl_backends
+
+    # "hand over" is not a phrasing nl_parser knows, so every input reaches the
+    # cache and the model. The ref token makes each input a cache miss.
+    total = int(args.rate * args.duration)
+    requests = []
+    replies = {}
+    for i in range(total):
+        author = f"benchuser{i % args.users}"
+        recipient = f"recipient{i % 7}"
+        amount = 1 + i % 25
+        text = f"hand over {amount} of my bits to {recipient}"
+        if not args.repeat_inputs:
+            text += f" ref{i}"
+        replies[text] = f"s {recipient} {amount}"
+        requests.append((author, text))
+    backend = nl_backends.FakeBackend(args.latency, args.error_rate, replies, seed=1)
+    commands.set_nl_backend(backend)
+
+    # The pool keeps each user's commands in order, so the submit times of
+    # identical (author, text) pairs complete first in, first out
+    submitted = defaultdict(deque)
+    latencies = []
+    lock = threading.Lock()
+    process = commands.process_natural_language_commands
+
+    def timed_process(nl_commands):
+        try:
+            process(nl_commands)
+        finally:
+            done = time.perf_counter()
+            with lock:
+                for key in nl_commands:
+                    latencies.append(done - submitted[key].popleft())
+
+    commands.process_natural_language_commands = timed_process
+
+    print(f"Sending {total} requests at {args.rate}/s for {args.duration}s "
+          f"(fake latency {args.latency}s, error rate {args.error_rate}) to "
+          f"{gemini_config.NL_WORKER_THREADS} workers, queue size {gemini_config.NL_QUEUE_SIZE_PER_WORKER}, "
+          f"batches of up to {gemini_config.NL_BATCH_MAX_SIZE}...")
+    rejected = 0
+    started = time.perf_counter()
+    for i, (author, text) in enumerate(requests):
+        delay = started + i / args.rate - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        with lock:
+            submitted[(author, text)].append(time.perf_counter())
+        if not commands.submit_natural_language_command(author, text):
+            rejected += 1
+            with lock:
+                submitted[(author, text)].pop()
+    commands.wait_for_natural_language_commands()
+    elapsed = time.perf_counter() - started
+
+    samples = sorted(latencies)
+    counters = metrics.snapshot()["counters"]
+    batch_sizes = metrics.snapshot()["timings"].get("nl.batch_size")
+    print()
+    print(f"Completed:        {len(samples)} requests in {elapsed:.2f}s ({len(samples) / elapsed:.1f} req/s)")
+    print(f"Queue full:       {rejected} requests rejected with 'busy, try later'")
+    if samples:
+        print(f"Latency:          p50 {metrics.percentile_of(samples, 50):.3f}s  p95 {metrics.percentile_of(samples, 95):.3f}s  "
+              f"p99 {metrics.percentile_of(samples, 99):.3f}s  max {samples[-1]:.3f}s")
+    print(f"Model calls:      {backend.calls}")
+    print(f"Rate limited:     {counters.get('nl.rate_limited', 0)} reservations refused")
+    print(f"Unavailable:      {counters.get('nl.unavailable', 0)} requests got the 'all models unavailable' notice")
+    print(f"Cache:            {commands.translation_cache_stats()}")
+    if batch_sizes:
+        print(f"Batches:          {batch_sizes['count']} (p50 size {batch_sizes['p50']}, max {batch_sizes['max']}), "
+              f"{counters.get('nl.batch_fallbacks', 0)} fallbacks")
+    if args.hedging:
+        print(f"Hedges:           {counters.get('nl.hedges_started', 0)} started, {counters.get('nl.hedge_wins', 0)} won")
+    for model_name, health in commands.model_health_snapshot().items():
+        print(f"  {model_name}: {health}")
+
+
+if __name__ == "__main__":
+    main()
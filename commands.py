@@ -1,9 +1,35 @@
-from datetime import timedelta
+from datetime import timedelta, datetime, timezone
+import atexit
+import heapq
+import os
+import queue
+import threading
 import time
-import data # data.check_rate_limits, data.record_api_call, data.add_notification, data.generate_readable_timestamp
-from google import genai
-# Using genai.types directly is often cleaner if 'types' is not extensively used standalone.
+import data # data.reserve_api_call, data.release_api_call, data.add_notification, data.generate_readable_timestamp
 import gemini_config
+import metrics
+import model_health
+import nl_backends
+import nl_parser
+import translation_cache
+
+# Comment polling: pages of COMMENT_PAGE_SIZE are fetched back to the last
+# processed comment; the poll interval drops to the minimum while comments keep
+# arriving and doubles up to the maximum while the project is quiet
+COMMENT_PAGE_SIZE = 40
+# Consecutive pages overlap by this many comments, so a comment deleted
+# between two fetches doesn't shift an unprocessed one out of the window
+COMMENT_PAGE_OVERLAP = 5
+COMMENT_MAX_CATCHUP_PAGES = 10
+COMMENT_POLL_MIN_SECONDS = 5
+COMMENT_POLL_MAX_SECONDS = 60
+
+METRICS_LOG_INTERVAL_SECONDS = 300  # how often metrics_logger_thread prints the metrics
+
+# Subscriptions are scheduled in a heap keyed on their next payment; the
+# processor sleeps until the earliest one is due (or a subscription changes)
+# and reloads the full schedule at least once per resync interval
+SUBSCRIPTION_RESYNC_SECONDS = 3600
 
 # Cycle times for subscriptions
 CYCLE_TIMES = {
@@ -34,16 +60,13 @@ def process_comment_command(comment_author, command_parts):
         if amount <= 0:
             data.add_notification(sender, f"{ts} - Amount must be positive for !s command.")
             return
-        sender_balance = data.get_balance(sender)
-        if sender_balance < amount:
-            data.add_notification(sender, f"{ts} - Insufficient balance ({sender_balance:.1f} bits) to send {amount:.1f} bits to {receiver}.")
+        result = data.transfer(sender, receiver, amount)
+        if result is None:
+            data.add_notification(sender, f"{ts} - Insufficient balance ({data.get_balance(sender):.1f} bits) to send {amount:.1f} bits to {receiver}.")
             return
-        receiver_balance = data.get_balance(receiver)
-        data.set_balance(sender, sender_balance - amount)
-        data.set_balance(receiver, receiver_balance + amount)
-        data.save_transaction(sender, receiver, amount)
+        sender_balance, _ = result
         data.add_notification(receiver, f"{ts} - {sender} gave you {amount:.1f} bits via comment!")
-        data.add_notification(sender, f"{ts} - You gave {amount:.1f} bits to {receiver} via comment. Your new balance: {data.get_balance(sender):.1f}")
+        data.add_notification(sender, f"{ts} - You gave {amount:.1f} bits to {receiver} via comment. Your new balance: {sender_balance:.1f}")
         print(f"Processed s command: {sender} sent {amount} to {receiver}")
 
     elif command == "sub":
@@ -66,20 +89,17 @@ def process_comment_command(comment_author, command_parts):
         if amount <= 0:
             data.add_notification(sender, f"{ts} - Subscription amount must be positive.")
             return
-        sender_balance = data.get_balance(sender)
-        if sender_balance < amount:
-            data.add_notification(sender, f"{ts} - Insufficient balance ({sender_balance:.1f} bits) for initial subscription payment of {amount:.1f} bits to {payee}.")
+        result = data.transfer(sender, payee, amount)
+        if result is None:
+            data.add_notification(sender, f"{ts} - Insufficient balance ({data.get_balance(sender):.1f} bits) for initial subscription payment of {amount:.1f} bits to {payee}.")
             return
-        receiver_balance = data.get_balance(payee)
-        data.set_balance(sender, sender_balance - amount)
-        data.set_balance(payee, receiver_balance + amount)
-        data.save_transaction(sender, payee, amount)
+        sender_balance, _ = result
         current_time = int(time.time())
         cycle_seconds = CYCLE_TIMES[cycle_type].total_seconds()
         next_payment_timestamp = current_time + cycle_seconds
         data.add_subscription(sender, payee, amount, cycle_type, current_time, next_payment_timestamp)
         data.add_notification(payee, f"{ts} - {sender} subscribed to pay you {amount:.1f} bits every {cycle_type}!")
-        data.add_notification(sender, f"{ts} - You subscribed to pay {payee} {amount:.1f} bits every {cycle_type}. Your new balance: {data.get_balance(sender):.1f}")
+        data.add_notification(sender, f"{ts} - You subscribed to pay {payee} {amount:.1f} bits every {cycle_type}. Your new balance: {sender_balance:.1f}")
         print(f"Processed sub command: {sender} subscribed to {payee} for {amount} {cycle_type}")
 
     elif command == "can":
@@ -123,15 +143,18 @@ def process_comment_command(comment_author, command_parts):
         if data.get_company_data(company_name) is not None:
             data.add_notification(sender, f"{ts} - You already own a company: {company_name}. You cannot found another one.")
             return
-        sender_balance = data.get_balance(sender)
-        if sender_balance < initial_amount:
-            data.add_notification(sender, f"{ts} - Insufficient balance ({sender_balance:.1f} bits) to fund your new company with {initial_amount:.1f} bits.")
+        # Checked up front so a failed found leaves no empty company account;
+        # the transfer below is what actually guards the funds
+        result = None
+        if data.get_balance(sender) >= initial_amount:
+            # The company account starts at 0 so the transfer is its whole balance
+            data.set_balance(company_name, 0)
+            result = data.transfer(sender, company_name, initial_amount)
+        if result is None:
+            data.add_notification(sender, f"{ts} - Insufficient balance ({data.get_balance(sender):.1f} bits) to fund your new company with {initial_amount:.1f} bits.")
             return
-        data.set_balance(sender, sender_balance - initial_amount)
-        data.set_balance(company_name, initial_amount)
-        data.save_transaction(sender, company_name, initial_amount)
         if data.add_company(company_name, sender):
-            data.add_notification(sender, f"{ts} - You founded a new company: {company_name} with {initial_amount:.1f} bits! Your personal balance: {data.get_balance(sender):.1f}")
+            data.add_notification(sender, f"{ts} - You founded a new company: {company_name} with {initial_amount:.1f} bits! Your personal balance: {result[0]:.1f}")
             print(f"Processed found command: {sender} founded {company_name} with {initial_amount} bits.")
         else:
             data.add_notification(sender, f"{ts} - Failed to create company {company_name}. It might already exist.")
@@ -183,16 +206,13 @@ def process_comment_command(comment_author, command_parts):
         if not data.is_company_member(company_name_arg, sender):
             data.add_notification(sender, f"{ts} - You are not an authorized member of '{company_name_arg}' to send funds.")
             return
-        company_balance = data.get_balance(company_name_arg)
-        if company_balance < amount:
-            data.add_notification(sender, f"{ts} - Company '{company_name_arg}' has insufficient balance ({company_balance:.1f} bits) to send {amount:.1f} bits to {recipient}.")
+        result = data.transfer(company_name_arg, recipient, amount)
+        if result is None:
+            data.add_notification(sender, f"{ts} - Company '{company_name_arg}' has insufficient balance ({data.get_balance(company_name_arg):.1f} bits) to send {amount:.1f} bits to {recipient}.")
             return
-        recipient_balance = data.get_balance(recipient)
-        data.set_balance(company_name_arg, company_balance - amount)
-        data.set_balance(recipient, recipient_balance + amount)
-        data.save_transaction(company_name_arg, recipient, amount)
+        company_balance, _ = result
         data.add_notification(recipient, f"{ts} - Company '{company_name_arg}' sent you {amount:.1f} bits!")
-        data.add_notification(sender, f"{ts} - You sent {amount:.1f} bits from '{company_name_arg}' to {recipient}. Company balance: {data.get_balance(company_name_arg):.1f}")
+        data.add_notification(sender, f"{ts} - You sent {amount:.1f} bits from '{company_name_arg}' to {recipient}. Company balance: {company_balance:.1f}")
         print(f"Processed sendco command: {sender} sent {amount} from {company_name_arg} to {recipient}.")
 
     elif command == "print":
@@ -210,9 +230,8 @@ def process_comment_command(comment_author, command_parts):
         if amount <= 0:
             data.add_notification(sender, f"{ts} - Amount must be positive for !print.")
             return
-        bal = data.get_balance("officialtreasury")
-        data.set_balance("officialtreasury", bal + amount)
-        data.add_notification(sender, f"{ts} - Printed {amount:.1f} bits into officialtreasury. Balance: {data.get_balance('officialtreasury'):.1f}")
+        treasury_balance = data.adjust_balance("officialtreasury", amount)
+        data.add_notification(sender, f"{ts} - Printed {amount:.1f} bits into officialtreasury. Balance: {treasury_balance:.1f}")
 
     elif command == "burn":
         if len(command_parts) != 2:
@@ -229,12 +248,11 @@ def process_comment_command(comment_author, command_parts):
         if amount <= 0:
             data.add_notification(sender, f"{ts} - Amount must be positive for !burn.")
             return
-        bal = data.get_balance("officialtreasury")
-        if bal < amount:
+        treasury_balance = data.adjust_balance("officialtreasury", -amount)
+        if treasury_balance is None:
             data.add_notification(sender, f"{ts} - officialtreasury has insufficient balance to burn {amount:.1f} bits.")
             return
-        data.set_balance("officialtreasury", bal - amount)
-        data.add_notification(sender, f"{ts} - Burned {amount:.1f} bits from officialtreasury. Balance: {data.get_balance('officialtreasury'):.1f}")
+        data.add_notification(sender, f"{ts} - Burned {amount:.1f} bits from officialtreasury. Balance: {treasury_balance:.1f}")
 
     elif command == "spend":
         if len(command_parts) != 3:
@@ -252,115 +270,270 @@ def process_comment_command(comment_author, command_parts):
             data.add_notification(sender, f"{ts} - Amount must be positive for !spend.")
             return
         target = data.fix_name(command_parts[2])
-        treasury_bal = data.get_balance("officialtreasury")
-        if treasury_bal < amount:
+        result = data.transfer("officialtreasury", target, amount)
+        if result is None:
             data.add_notification(sender, f"{ts} - officialtreasury has insufficient balance to spend {amount:.1f} bits.")
             return
-        recipient_bal = data.get_balance(target)
-        data.set_balance("officialtreasury", treasury_bal - amount)
-        data.set_balance(target, recipient_bal + amount)
-        data.save_transaction("officialtreasury", target, amount)
+        treasury_bal, _ = result
         data.add_notification(target, f"{ts} - officialtreasury sent you {amount:.1f} bits!")
-        data.add_notification(sender, f"{ts} - Spent {amount:.1f} bits from officialtreasury to {target}. Balance: {data.get_balance('officialtreasury'):.1f}")
+        data.add_notification(sender, f"{ts} - Spent {amount:.1f} bits from officialtreasury to {target}. Balance: {treasury_bal:.1f}")
         
 
+def _handle_comment(comment):
+    content = comment.content
+    author = comment.author_name
+    command_parts = content.strip().split(" ")
+    if not command_parts or not command_parts[0]:
+        data.add_processed_comment(comment.id)
+        return
+    first_word = command_parts[0].lower()
+    clean_word = first_word.lstrip("!")
+    clean_word = first_word.lstrip("!")
+    # Updated list of known commands for direct processing
+    known_direct_commands = ["s", "sub", "can", "canall", "found", "add", "sendco", "print", "burn", "spend"]
+
+    if clean_word in known_direct_commands:
+        print(f"Found direct command '{content}' from {author} (ID: {comment.id})")
+        # command_parts already includes the command with '!' (e.g., ['!s', 'user', '10'])
+        # or without '!' if lstrip removed it and it was just 's'.
+        # process_comment_command expects '!command' as first part.
+        # Ensure first part has '!' if it was stripped by clean_word logic.
+        # Original command_parts[0] is like '!s' or 's'.
+        # process_comment_command internally lstrips '!' again.
+        # So, it's robust to either ['!s', 'user', '10'] or ['s', 'user', '10'] if first_word was 's'.
+        # However, our clean_word logic means command_parts[0] might be just 's'.
+        # Let's ensure process_comment_command receives it as it expects.
+        # The original `command_parts` is `['!s', 'user', '10']`.
+        # `process_comment_command` does `command_parts[0].lower().lstrip("!")`.
+        # So, passing `command_parts` directly is correct.
+        process_comment_command(author, command_parts)
+        data.add_processed_comment(comment.id)
+    elif clean_word == "n":
+        if len(command_parts) > 1: # e.g., ['!n', 'send', '10', 'to', 'user']
+            natural_input = " ".join(command_parts[1:])
+            print(f"Found natural language command '!n {natural_input}' from {author} (ID: {comment.id})")
+            submit_natural_language_command(author, natural_input)
+            data.add_processed_comment(comment.id)
+        else: # Malformed !n command, e.g., just ['!n']
+            ts = data.generate_readable_timestamp()
+            # Ensure author's name is fixed for notification consistency
+            data.add_notification(data.fix_name(author), f"{ts} - Invalid !n command format. Use: !n [your natural language instruction].")
+            data.add_processed_comment(comment.id) # Mark as processed to avoid retrying
+    else:
+        # If it's not a known direct command and not '!n',
+        # and it started with '!', it's an unknown command.
+        # Otherwise, it's just a regular comment not intended for the bot.
+        if first_word.startswith("!"):
+             print(f"Unknown command '{content}' from {author} (ID: {comment.id}). Marked as processed.")
+        # Always mark as processed to prevent re-evaluation in next cycle.
+        data.add_processed_comment(comment.id)
+
+
+def _comment_created_at(comment):
+    try:
+        created = datetime.fromisoformat(str(comment.datetime_created).replace("Z", "+00:00"))
+    except (AttributeError, ValueError):
+        return None
+    if created.tzinfo is None:
+        created = created.replace(tzinfo=timezone.utc)
+    return created.timestamp()
+
+
+def _fetch_new_comments(project):
+    """
+    Page back through the project's comments (newest first) until reaching one
+    that was already processed. Returns (new comments oldest first, truncated),
+    where truncated means COMMENT_MAX_CATCHUP_PAGES ran out before that point.
+
+    Comments posted or deleted while paging shift the later pages. A new
+    comment pushes the last one of a page onto the next page as well, so
+    comments are de-duplicated by ID. A deletion pulls comments back a page;
+    pages overlap by COMMENT_PAGE_OVERLAP so up to that many deletions during
+    one fetch lose nothing, beyond that an unprocessed comment can be missed.
+    """
+    new_comments = []
+    seen = set()
+    for page in range(COMMENT_MAX_CATCHUP_PAGES):
+        offset = page * (COMMENT_PAGE_SIZE - COMMENT_PAGE_OVERLAP)
+        comments = project.comments(limit=COMMENT_PAGE_SIZE, offset=offset)
+        for comment in comments:
+            if comment.id in seen:
+                continue
+            if data.is_comment_processed(comment.id):
+                return new_comments[::-1], False
+            seen.add(comment.id)
+            new_comments.append(comment)
+        if len(comments) < COMMENT_PAGE_SIZE:
+            return new_comments[::-1], False
+    return new_comments[::-1], True
+
+
 def comment_listener_thread(project):
+    interval = COMMENT_POLL_MIN_SECONDS
     while True:
         try:
-            print("Checking for new comments...")
-            comments = project.comments(limit=30)
-            for comment in reversed(comments):
-                if not data.is_comment_processed(comment.id):
-                    content = comment.content
-                    author = comment.author_name
-                    command_parts = content.strip().split(" ")
-                    if not command_parts or not command_parts[0]:
-                        data.add_processed_comment(comment.id)
-                        continue
-                    first_word = command_parts[0].lower()
-                    clean_word = first_word.lstrip("!")
-                    clean_word = first_word.lstrip("!")
-                    # Updated list of known commands for direct processing
-                    known_direct_commands = ["s", "sub", "can", "canall", "found", "add", "sendco", "print", "burn", "spend"]
-
-                    if clean_word in known_direct_commands:
-                        print(f"Found direct command '{content}' from {author} (ID: {comment.id})")
-                        # command_parts already includes the command with '!' (e.g., ['!s', 'user', '10'])
-                        # or without '!' if lstrip removed it and it was just 's'.
-                        # process_comment_command expects '!command' as first part.
-                        # Ensure first part has '!' if it was stripped by clean_word logic.
-                        # Original command_parts[0] is like '!s' or 's'.
-                        # process_comment_command internally lstrips '!' again.
-                        # So, it's robust to either ['!s', 'user', '10'] or ['s', 'user', '10'] if first_word was 's'.
-                        # However, our clean_word logic means command_parts[0] might be just 's'.
-                        # Let's ensure process_comment_command receives it as it expects.
-                        # The original `command_parts` is `['!s', 'user', '10']`.
-                        # `process_comment_command` does `command_parts[0].lower().lstrip("!")`.
-                        # So, passing `command_parts` directly is correct.
-                        process_comment_command(author, command_parts)
-                        data.add_processed_comment(comment.id)
-                    elif clean_word == "n":
-                        if len(command_parts) > 1: # e.g., ['!n', 'send', '10', 'to', 'user']
-                            natural_input = " ".join(command_parts[1:])
-                            print(f"Found natural language command '!n {natural_input}' from {author} (ID: {comment.id})")
-                            process_natural_language_command(author, natural_input)
-                            data.add_processed_comment(comment.id)
-                        else: # Malformed !n command, e.g., just ['!n']
-                            ts = data.generate_readable_timestamp()
-                            # Ensure author's name is fixed for notification consistency
-                            data.add_notification(data.fix_name(author), f"{ts} - Invalid !n command format. Use: !n [your natural language instruction].")
-                            data.add_processed_comment(comment.id) # Mark as processed to avoid retrying
-                    else:
-                        # If it's not a known direct command and not '!n',
-                        # and it started with '!', it's an unknown command.
-                        # Otherwise, it's just a regular comment not intended for the bot.
-                        if first_word.startswith("!"):
-                             print(f"Unknown command '{content}' from {author} (ID: {comment.id}). Marked as processed.")
-                        # Always mark as processed to prevent re-evaluation in next cycle.
-                        data.add_processed_comment(comment.id)
+            comments, truncated = _fetch_new_comments(project)
+            metrics.observe("comment_listener.comments_per_poll", len(comments))
+            if truncated:
+                # Anything older than the catch-up window will never be seen;
+                # how many comments that was is unknown, so count the polls
+                metrics.incr("comment_listener.truncated_polls")
+                print(f"Warning: comment backlog exceeds {COMMENT_MAX_CATCHUP_PAGES} pages; older comments were skipped.")
+            if comments:
+                created = _comment_created_at(comments[0])
+                if created is not None:
+                    lag = max(time.time() - created, 0)
+                    metrics.set_gauge("comment_listener.catchup_lag_seconds", lag)
+                    metrics.observe("comment_listener.catchup_lag_seconds", lag)
+                print(f"Processing {len(comments)} new comment(s)...")
+            for comment in comments:
+                if data.is_comment_processed(comment.id):
+                    continue
+                _handle_comment(comment)
+                metrics.incr("comment_listener.comments_processed")
+            # Poll quickly while comments keep arriving, back off while it is quiet
+            if comments:
+                interval = COMMENT_POLL_MIN_SECONDS
+            else:
+                interval = min(interval * 2, COMMENT_POLL_MAX_SECONDS)
         except Exception as e:
+            metrics.incr("comment_listener.errors")
             print(f"Error in comment listener: {e}")
-        time.sleep(15)
+        metrics.set_gauge("comment_listener.poll_interval_seconds", interval)
+        time.sleep(interval)
+
+
+def _settle_subscriptions(subscriptions, current_time):
+    """
+    Charges a batch of due subscriptions in one ledger pass.
+
+    Each payer's subscriptions are charged in a fixed order (oldest due first,
+    then by payee) so that when funds run out, the same ones are cancelled
+    every time.
+
+    Returns:
+        (payments, cancelled): payments as (payer, payee, last_paid, next_payment)
+        tuples for data.record_subscription_payments, cancelled as (payer, payee) keys.
+    """
+    started = time.perf_counter()
+    subscriptions = sorted(subscriptions, key=lambda sub: (sub["payer"], sub["next_payment_timestamp"], sub["payee"]))
+    results = data.apply_transfers([(sub["payer"], sub["payee"], sub["amount"]) for sub in subscriptions])
+    ts = data.generate_readable_timestamp()
+    payments = []
+    cancelled = []
+    notifications = []
+    for sub, result in zip(subscriptions, results):
+        payer = sub["payer"]
+        payee = sub["payee"]
+        amount = sub["amount"]
+        cycle_type = sub["cycle"]
+        if result is None:
+            notifications.append((payer, f"{ts} - Your subscription payment of {amount:.1f} bits to {payee} failed due to insufficient balance. Subscription cancelled."))
+            notifications.append((payee, f"{ts} - {payer}'s subscription payment of {amount:.1f} bits failed due to insufficient balance. Subscription cancelled."))
+            print(f"Payment failed: {payer} to {payee}. Insufficient balance. Subscription cancelled.")
+            cancelled.append((payer, payee))
+            continue
+        payer_balance, _ = result
+        notifications.append((payee, f"{ts} - {payer} paid you {amount:.1f} bits for your {cycle_type} subscription!"))
+        notifications.append((payer, f"{ts} - You paid {amount:.1f} bits to {payee} for your {cycle_type} subscription. Your new balance: {payer_balance:.1f}"))
+        next_payment_timestamp = current_time + CYCLE_TIMES[cycle_type].total_seconds()
+        payments.append((payer, payee, current_time, next_payment_timestamp))
+    data.add_notifications(notifications)
+    elapsed = time.perf_counter() - started
+    metrics.incr("subscriptions.settled", len(payments))
+    metrics.incr("subscriptions.cancelled", len(cancelled))
+    metrics.observe("subscriptions.settle_seconds", elapsed)
+    print(f"Settled {len(payments)} subscription payments ({len(cancelled)} cancelled) in {elapsed * 1000:.1f} ms")
+    return payments, cancelled
+
+
+class _SubscriptionSchedule:
+    """
+    Min-heap of (next_payment_timestamp, payer, payee). Entries are never
+    removed from the heap directly; `scheduled` holds the live timestamp per
+    subscription and anything that disagrees with it is skipped when popped.
+    """
+
+    def __init__(self):
+        self.heap = []
+        self.scheduled = {}
+
+    def reload(self, subscriptions):
+        self.scheduled = {(sub["payer"], sub["payee"]): sub["next_payment_timestamp"] for sub in subscriptions}
+        self.heap = [(ts, payer, payee) for (payer, payee), ts in self.scheduled.items()]
+        heapq.heapify(self.heap)
+
+    def push(self, payer, payee, next_payment_timestamp):
+        self.scheduled[(payer, payee)] = next_payment_timestamp
+        heapq.heappush(self.heap, (next_payment_timestamp, payer, payee))
+
+    def discard(self, key):
+        self.scheduled.pop(key, None)
+
+    def next_due(self):
+        while self.heap:
+            ts, payer, payee = self.heap[0]
+            if self.scheduled.get((payer, payee)) == ts:
+                return ts
+            heapq.heappop(self.heap)
+        return None
+
+    def pop_due(self, now):
+        due = []
+        while self.heap and self.heap[0][0] <= now:
+            ts, payer, payee = heapq.heappop(self.heap)
+            if self.scheduled.get((payer, payee)) == ts:
+                del self.scheduled[(payer, payee)]
+                due.append((payer, payee))
+        return due
 
 
 def subscription_processor_thread():
+    schedule = _SubscriptionSchedule()
+    next_resync = 0
     while True:
         try:
+            if time.time() >= next_resync:
+                schedule.reload(data.get_all_subscriptions())
+                next_resync = time.time() + SUBSCRIPTION_RESYNC_SECONDS
+
             current_time = int(time.time())
-            subscriptions = data._subscriptions_load()
-            updated_subscriptions = []
-            for sub in subscriptions:
-                payer = sub["payer"]
-                payee = sub["payee"]
-                amount = sub["amount"]
-                cycle_type = sub["cycle"]
-                next_payment_timestamp = sub["next_payment_timestamp"]
-                if current_time >= next_payment_timestamp:
-                    print(f"Subscription payment due: {payer} to {payee} for {amount} ({cycle_type})")
-                    payer_balance = data.get_balance(payer)
-                    if payer_balance >= amount:
-                        receiver_balance = data.get_balance(payee)
-                        data.set_balance(payer, payer_balance - amount)
-                        data.set_balance(payee, receiver_balance + amount)
-                        data.save_transaction(payer, payee, amount)
-                        ts = data.generate_readable_timestamp()
-                        data.add_notification(payee, f"{ts} - {payer} paid you {amount:.1f} bits for your {cycle_type} subscription!")
-                        data.add_notification(payer, f"{ts} - You paid {amount:.1f} bits to {payee} for your {cycle_type} subscription. Your new balance: {data.get_balance(payer):.1f}")
-                        cycle_seconds = CYCLE_TIMES[cycle_type].total_seconds()
-                        sub["last_paid_timestamp"] = current_time
-                        sub["next_payment_timestamp"] = current_time + cycle_seconds
-                        print(f"Payment successful: {payer} to {payee}. Next payment due: {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(sub['next_payment_timestamp']))}")
-                    else:
-                        ts = data.generate_readable_timestamp()
-                        data.add_notification(payer, f"{ts} - Your subscription payment of {amount:.1f} bits to {payee} failed due to insufficient balance. Subscription cancelled.")
-                        data.add_notification(payee, f"{ts} - {payer}'s subscription payment of {amount:.1f} bits failed due to insufficient balance. Subscription cancelled.")
-                        print(f"Payment failed: {payer} to {payee}. Insufficient balance. Subscription cancelled.")
+            due_keys = schedule.pop_due(current_time)
+            if due_keys:
+                # Re-read only the due subscriptions; one that was changed or
+                # removed since it was scheduled is rescheduled or dropped
+                subscriptions = data.get_subscriptions(due_keys)
+                due = []
+                for key in due_keys:
+                    sub = subscriptions.get(key)
+                    if sub is None:
+                        continue
+                    if sub["next_payment_timestamp"] > current_time:
+                        schedule.push(*key, sub["next_payment_timestamp"])
                         continue
-                updated_subscriptions.append(sub)
-            data._subscriptions_save(updated_subscriptions)
+                    due.append(sub)
+                payments, cancelled = _settle_subscriptions(due, current_time) if due else ([], [])
+                for payer, payee, _, next_payment_timestamp in payments:
+                    schedule.push(payer, payee, next_payment_timestamp)
+                data.record_subscription_payments(payments)
+                data.remove_subscriptions(cancelled)
+
+            timeout = next_resync - time.time()
+            next_due = schedule.next_due()
+            if next_due is not None:
+                timeout = min(timeout, next_due - time.time())
+            changed = data.wait_for_subscription_changes(max(timeout, 0))
+            if changed:
+                subscriptions = data.get_subscriptions(changed)
+                for key in changed:
+                    schedule.discard(key)
+                    sub = subscriptions.get(key)
+                    if sub is not None:
+                        schedule.push(*key, sub["next_payment_timestamp"])
         except Exception as e:
             print(f"Error in subscription processor: {e}")
-        time.sleep(60)
+            next_resync = 0
+            time.sleep(60)
 
 
 def election_thread():
@@ -372,7 +545,60 @@ def election_thread():
         time.sleep(3600)
 
 
-def get_gemini_command_response(natural_language_input: str, model_name: str, api_key: str) -> str | None:
+# Backend that answers model calls (the Gemini API unless gemini_config.NL_BACKEND
+# says otherwise); created on first use so importing commands needs no API client.
+_nl_backend = None
+_nl_backend_lock = threading.Lock()
+
+
+def _get_nl_backend():
+    global _nl_backend
+    with _nl_backend_lock:
+        if _nl_backend is None:
+            _nl_backend = nl_backends.create_backend()
+        return _nl_backend
+
+
+def set_nl_backend(backend):
+    """Replace the NL backend, e.g. with an nl_backends.FakeBackend for load tests."""
+    global _nl_backend
+    with _nl_backend_lock:
+        _nl_backend = backend
+
+
+_model_health = model_health.ModelHealth(
+    gemini_config.BREAKER_FAILURE_THRESHOLD,
+    gemini_config.BREAKER_COOLDOWN_SECONDS,
+    gemini_config.MODEL_HEALTH_WINDOW,
+)
+
+
+def _ordered_models():
+    """Model names in the order to try them: fastest healthy model with quota left first."""
+    names = [model_config['name'] for model_config in gemini_config.get_model_configs()]
+    return _model_health.order(names, data.remaining_api_calls)
+
+
+def _reserve_model(usernames, model_name):
+    """Reserves quota for one call and passes the model's circuit breaker. Returns the reservation or None."""
+    reservation = data.reserve_batched_api_call(usernames, model_name)
+    if reservation is None:
+        metrics.incr("nl.rate_limited")
+        print(f"Rate limit check failed for {', '.join(usernames)}, model {model_name}.")
+        return None
+    if not _model_health.allow(model_name):
+        data.release_batched_api_call(usernames, model_name, reservation)
+        print(f"Skipping {model_name}: circuit breaker is open.")
+        return None
+    return reservation
+
+
+def model_health_snapshot():
+    """Breaker state, success rate and latency percentiles per model."""
+    return _model_health.snapshot()
+
+
+def get_gemini_command_response(natural_language_input: str, model_name: str, api_key: str, system_instruction: str = None) -> str | None:
     """
     Gets a command response from the Gemini API based on natural language input.
 
@@ -380,120 +606,444 @@ def get_gemini_command_response(natural_language_input: str, model_name: str, ap
         natural_language_input: The user's input in natural language.
         model_name: The name of the Gemini model to use.
         api_key: The Gemini API key.
+        system_instruction: Overrides gemini_config.SYSTEM_INSTRUCTION (used for batched prompts).
 
     Returns:
         The command string from Gemini, or None if an error occurs or no command is found.
     """
+    started = time.perf_counter()
     try:
-        client = genai.Client(api_key=api_key)
-
-        config = genai.types.GenerateContentConfig(
-            system_instruction=gemini_config.SYSTEM_INSTRUCTION,
-            candidate_count=1,
+        response_text = _get_nl_backend().generate(
+            natural_language_input,
+            model_name,
+            api_key,
+            system_instruction or gemini_config.SYSTEM_INSTRUCTION,
+            gemini_config.get_model_timeout(model_name),
         )
-
-        response = client.models.generate_content(
-            model=model_name,
-            contents=[natural_language_input],
-            config=config,
-        )
-
-        if response.candidates:
-            candidate = response.candidates[0]
-            if candidate.content and candidate.content.parts:
-                response_text = "".join(part.text for part in candidate.content.parts if hasattr(part, 'text'))
-                if response_text:
-                    return response_text.strip()
-                else:
-                    print(f"Warning: Gemini response candidate for {model_name} had no text in the content parts.")
-                    return None
-            elif hasattr(response, 'text') and response.text: # Fallback
-                 return response.text.strip()
-            else:
-                print(f"Warning: Gemini response for {model_name} has candidates but no parsable text content.")
-                return None
-        else:
-            print(f"Warning: Gemini response for {model_name} has no candidates.")
-            return None
+        latency = time.perf_counter() - started
+        metrics.observe(f"gemini.latency_seconds.{model_name}", latency)
+        # An empty reply is a normal answer (the model returns nothing for
+        # input that maps to no command), so only exceptions count against
+        # the breaker; callers still move on to the next model
+        _model_health.record_success(model_name, latency)
+        return response_text
 
     # General catch-all for unexpected errors
     except Exception as e:
+        _model_health.record_failure(model_name)
+        metrics.incr(f"gemini.errors.{model_name}")
+        metrics.observe(f"gemini.latency_seconds.{model_name}", time.perf_counter() - started)
         print(f"An unexpected error of type {type(e).__name__} occurred during Gemini API call for {model_name}: {e}")
         return None
 
 
-def process_natural_language_command(comment_author: str, natural_language_input: str):
-    """
-    Processes a natural language command by trying available Gemini models.
-    """
-    author_name_fixed = data.fix_name(comment_author) # Use fixed name for rate limiting and notifications
+NL_KNOWN_COMMANDS = ["s", "sub", "can", "canall", "found", "add", "sendco", "print", "burn", "spend"]
+
+_translation_cache = translation_cache.TranslationCache(
+    os.path.join(data.DATA_DIR, "translation_cache.json"),
+    gemini_config.TRANSLATION_CACHE_SIZE,
+    gemini_config.TRANSLATION_CACHE_TTL_SECONDS,
+)
+atexit.register(_translation_cache.save)
+
+
+def _is_runnable_response(response_text):
+    lines = [line.split() for line in response_text.strip().split('\n') if line.strip()]
+    return bool(lines) and all(words[0].lower() in NL_KNOWN_COMMANDS for words in lines)
+
+
+def _run_natural_language_response(comment_author: str, source: str, response_text: str):
+    """Executes the command lines produced for a !n command; source names the model (or cache) they came from."""
+    author_name_fixed = data.fix_name(comment_author)
+    potential_commands = response_text.strip().split('\n')
+
+    if not potential_commands or not potential_commands[0].strip():
+        ts = data.generate_readable_timestamp()
+        data.add_notification(author_name_fixed, f"{ts} - Your natural language command was processed by {source} but resulted in no specific action.")
+        print(f"User {author_name_fixed}, model {source}: NL command processed, no action from AI output '{response_text}'.")
+        return # Successfully processed by AI, but no command output.
+
+    executed_at_least_one = False
+
+    for cmd_line in potential_commands:
+        cmd_line = cmd_line.strip()
+        if cmd_line:
+            gemini_command_parts = cmd_line.split(" ")
+            if not gemini_command_parts: continue
+
+            actual_command_keyword = gemini_command_parts[0].lower()
+
+            if actual_command_keyword in NL_KNOWN_COMMANDS:
+                print(f"User {author_name_fixed}, model {source}: Executing AI generated command: !{actual_command_keyword} {' '.join(gemini_command_parts[1:])}")
+                # process_comment_command expects the author name and the full command parts list
+                # where the first part is the command including "!"
+                process_comment_command(comment_author, [f"!{actual_command_keyword}"] + gemini_command_parts[1:])
+                executed_at_least_one = True
+            else:
+                ts = data.generate_readable_timestamp()
+                error_msg = f"{ts} - Skipped unknown command from AI ({source}): '{cmd_line}'."
+                print(error_msg) # Also print to server log for debugging
+                data.add_notification(author_name_fixed, error_msg)
+
+    if not executed_at_least_one:
+        # AI returned something, but it wasn't a runnable command (e.g. just text, or unknown command)
+        ts = data.generate_readable_timestamp()
+        msg = f"{ts} - AI ({source}) processed your request but didn't return a recognized command. AI Output: '{response_text}'"
+        data.add_notification(author_name_fixed, msg)
+        print(f"User {author_name_fixed}, model {source}: AI output not a recognized command: '{response_text}'.")
 
-    for model_config in gemini_config.get_model_configs():
-        model_name = model_config['name']
 
-        can_use_model = data.check_rate_limits(author_name_fixed, model_name)
+def _translate_with_models(author_name_fixed: str, natural_language_input: str):
+    """Walks the model chain for one input. Returns (model_name, response_text), or None if every model failed or was rate-limited."""
+    if gemini_config.NL_HEDGING_ENABLED:
+        return _translate_hedged(author_name_fixed, natural_language_input)
+    for model_name in _ordered_models():
+        reservation = _reserve_model([author_name_fixed], model_name)
 
-        if can_use_model:
+        if reservation is not None:
             print(f"Attempting to use model: {model_name} for user {author_name_fixed} for input: '{natural_language_input}'")
             # Ensure GEMINI_API_KEY is correctly passed; it's defined in gemini_config
             gemini_response_text = get_gemini_command_response(natural_language_input, model_name, gemini_config.GEMINI_API_KEY)
 
             if gemini_response_text is not None and gemini_response_text.strip():
-                data.record_api_call(author_name_fixed, model_name)
-                potential_commands = gemini_response_text.strip().split('\n')
-
-                if not potential_commands or not potential_commands[0].strip():
-                    ts = data.generate_readable_timestamp()
-                    data.add_notification(author_name_fixed, f"{ts} - Your natural language command was processed by {model_name} but resulted in no specific action.")
-                    print(f"User {author_name_fixed}, model {model_name}: NL command processed, no action from AI output '{gemini_response_text}'.")
-                    return # Successfully processed by AI, but no command output.
-
-                executed_at_least_one = False
-                known_commands = ["s", "sub", "can", "canall", "found", "add", "sendco", "print", "burn", "spend"]
-
-                for cmd_line in potential_commands:
-                    cmd_line = cmd_line.strip()
-                    if cmd_line:
-                        gemini_command_parts = cmd_line.split(" ")
-                        if not gemini_command_parts: continue
-
-                        actual_command_keyword = gemini_command_parts[0].lower()
-
-                        if actual_command_keyword in known_commands:
-                            print(f"User {author_name_fixed}, model {model_name}: Executing AI generated command: !{actual_command_keyword} {' '.join(gemini_command_parts[1:])}")
-                            # process_comment_command expects the author name and the full command parts list
-                            # where the first part is the command including "!"
-                            process_comment_command(comment_author, [f"!{actual_command_keyword}"] + gemini_command_parts[1:])
-                            executed_at_least_one = True
-                        else:
-                            ts = data.generate_readable_timestamp()
-                            error_msg = f"{ts} - Skipped unknown command from AI ({model_name}): '{cmd_line}'."
-                            print(error_msg) # Also print to server log for debugging
-                            data.add_notification(author_name_fixed, error_msg)
-
-                if executed_at_least_one:
-                    # Optionally, notify user that command from AI was run
-                    # ts = data.generate_readable_timestamp()
-                    # data.add_notification(author_name_fixed, f"{ts} - Your natural language command was successfully executed by {model_name}.")
-                    return # Stop trying other models if commands were processed
-                elif not executed_at_least_one and potential_commands and potential_commands[0].strip():
-                    # AI returned something, but it wasn't a runnable command (e.g. just text, or unknown command)
-                    ts = data.generate_readable_timestamp()
-                    msg = f"{ts} - AI ({model_name}) processed your request but didn't return a recognized command. AI Output: '{gemini_response_text}'"
-                    data.add_notification(author_name_fixed, msg)
-                    print(f"User {author_name_fixed}, model {model_name}: AI output not a recognized command: '{gemini_response_text}'.")
-                    return # Handled by this model, even if not runnable.
-            else: # Gemini returned None or empty string
-                print(f"Model {model_name} returned no valid response or an empty response for user {author_name_fixed}. Response: '{gemini_response_text}'")
-                # Optionally notify user model failed, or just try next model silently
-                # ts = data.generate_readable_timestamp()
-                # data.add_notification(author_name_fixed, f"{ts} - Model {model_name} could not process your request at this time.")
-                # Continue to the next model (fallback)
-        else:
-            print(f"Rate limit check failed for user {author_name_fixed}, model {model_name}.")
+                return model_name, gemini_response_text
+            # Gemini returned None or an empty string; the call isn't charged
+            data.release_api_call(author_name_fixed, model_name, reservation)
+            print(f"Model {model_name} returned no valid response or an empty response for user {author_name_fixed}. Response: '{gemini_response_text}'")
+            # Continue to the next model (fallback)
+    return None
+
+
+def _hedge_delay(model_name):
+    delay = _model_health.latency(model_name, gemini_config.NL_HEDGE_PERCENTILE)
+    return delay if delay is not None else gemini_config.NL_HEDGE_DEFAULT_DELAY_SECONDS
+
+
+def _translate_hedged(author_name_fixed: str, natural_language_input: str):
+    """
+    Like _translate_with_models, but when the model in flight is slower than
+    its hedge delay the next model is started alongside it; the first valid
+    answer wins and later ones are ignored. Quota is only reserved for calls
+    that are actually started, and a call that fails gives its reservation back.
+    """
+    models = iter(_ordered_models())
+    results = queue.Queue()
+
+    def call(model_name, reservation):
+        response_text = get_gemini_command_response(natural_language_input, model_name, gemini_config.GEMINI_API_KEY)
+        if response_text is None or not response_text.strip():
+            data.release_api_call(author_name_fixed, model_name, reservation)
+            response_text = None
+        results.put((model_name, response_text))
+
+    def launch():
+        for model_name in models:
+            reservation = _reserve_model([author_name_fixed], model_name)
+            if reservation is not None:
+                print(f"Attempting to use model: {model_name} for user {author_name_fixed} for input: '{natural_language_input}'")
+                threading.Thread(target=call, args=(model_name, reservation), daemon=True).start()
+                return model_name
+        return None
+
+    primary = latest = launch()
+    in_flight = 1 if latest else 0
+    hedged = False
+    while in_flight:
+        try:
+            model_name, response_text = results.get(timeout=_hedge_delay(latest) if latest else None)
+        except queue.Empty:
+            hedge = launch()
+            if hedge is None:
+                latest = None  # nothing left to hedge with; just wait
+            else:
+                metrics.incr("nl.hedges_started")
+                print(f"Model {latest} is slow; hedging with {hedge} for user {author_name_fixed}.")
+                latest = hedge
+                in_flight += 1
+                hedged = True
+            continue
+        in_flight -= 1
+        if response_text is not None:
+            if hedged:
+                metrics.incr("nl.hedge_wins" if model_name != primary else "nl.hedge_primary_wins")
+            return model_name, response_text
+        print(f"Model {model_name} returned no valid response for user {author_name_fixed}.")
+        if in_flight == 0:
+            latest = launch()
+            in_flight = 1 if latest else 0
+    return None
+
+
+def _resolve_locally(item):
+    """The local parser's or the translation cache's answer for an item as (source, response_text), or None."""
+    parsed = nl_parser.parse(item.text, data.is_company)
+    if parsed is not None:
+        metrics.incr("nl.local_parser")
+        print(f"Local parser handled input from user {item.author}: '{item.text}'")
+        return "local parser", parsed
+    cached = _translation_cache.lookup(item.text)
+    if cached is not None:
+        print(f"Translation cache hit for user {item.author} for input: '{item.text}'")
+        return "cache", cached
+    return None
+
+
+def process_natural_language_commands(nl_commands):
+    """
+    Processes (comment_author, natural_language_input) pairs: each goes to the
+    local parser, then the translation cache, and the rest to the Gemini
+    models, as one numbered prompt when more than one is left. The resulting
+    commands run in the order given, so one user's commands keep their order.
+    """
+    items = [_BatchItem(comment_author, natural_language_input) for comment_author, natural_language_input in nl_commands]
+    to_translate = []
+    for item in items:
+        item.result = _resolve_locally(item)
+        if item.result is None:
+            to_translate.append(item)
+    for start in range(0, len(to_translate), gemini_config.NL_BATCH_MAX_SIZE):
+        _translate_items(to_translate[start:start + gemini_config.NL_BATCH_MAX_SIZE])
+
+    for item in items:
+        if item.result is None:
+            # All models failed or were rate-limited
+            metrics.incr("nl.unavailable")
+            ts = data.generate_readable_timestamp()
+            final_msg = f"{ts} - Sorry, your natural language command could not be processed at this time. All models are currently unavailable or rate-limited."
+            data.add_notification(item.author, final_msg)
+            print(f"User {item.author}: All models failed or rate-limited for NL command: '{item.text}'.")
+            continue
+        source, response_text = item.result
+        if item in to_translate and _is_runnable_response(response_text):
+            _translation_cache.store(item.text, response_text)
+        try:
+            _run_natural_language_response(item.comment_author, source, response_text)
+        except Exception as e:
+            print(f"Error processing natural language command from {item.author}: {e}")
+
+
+def process_natural_language_command(comment_author: str, natural_language_input: str):
+    """Processes a single natural language command; see process_natural_language_commands."""
+    process_natural_language_commands([(comment_author, natural_language_input)])
+
+
+class _BatchItem:
+    def __init__(self, comment_author, natural_language_input):
+        self.comment_author = comment_author
+        self.author = data.fix_name(comment_author)  # Used for rate limiting and notifications
+        # Newlines would let one input pose as another's numbered section
+        self.text = " ".join(natural_language_input.split())
+        self.result = None  # (source, response_text)
+
+
+def _split_batch_response(response_text, count):
+    """Split a numbered batch reply into one text per request, or None if the numbering is off."""
+    sections = {}
+    current = None
+    for line in response_text.strip().split("\n"):
+        line = line.strip()
+        if line.startswith("[") and "]" in line and line[1:line.index("]")].isdigit():
+            current = int(line[1:line.index("]")])
+            if current in sections:
+                return None
+            sections[current] = []
+            rest = line[line.index("]") + 1:].strip()
+            if rest:
+                sections[current].append(rest)
+        elif line:
+            if current is None:
+                return None
+            sections[current].append(line)
+    if sorted(sections) != list(range(1, count + 1)):
+        return None
+    return ["\n".join(sections[i]) for i in range(1, count + 1)]
+
+
+# Word stems the user's text must contain for a batched reply to use a
+# command: one stem from every group. "canall" needs a cancel word and "all".
+_COMMAND_CUES = {
+    "s": [("send", "give", "gave", "pay", "paid", "transfer", "tip", "hand", "gift", "donat")],
+    "sub": [("sub",)],
+    "can": [("cancel", "stop", "end", "unsub", "quit", "drop")],
+    "canall": [("cancel", "stop", "end", "unsub", "quit", "drop"), ("all", "every")],
+    "found": [("found", "start", "creat", "make", "open", "launch", "company")],
+    "add": [("add", "invit", "member", "hire")],
+    "sendco": [("send", "give", "gave", "pay", "paid", "transfer", "tip", "hand", "gift", "donat")],
+    "print": [("print", "mint")],
+    "burn": [("burn", "destroy")],
+    "spend": [("spend", "spent")],
+}
 
-    # If loop finishes, all models failed or were rate-limited
+
+def _grounded(natural_language_input, response_text):
+    """
+    True if every command line is supported by the user's own input: its
+    keyword by a matching word (see _COMMAND_CUES) and every argument by a
+    word the user wrote. A batched reply that puts another request's commands
+    into this one's section must not be executed as this user.
+    """
+    words = {w.strip(",.!?;:\"'").lstrip("@").lower() for w in natural_language_input.split()}
+    for line in response_text.split("\n"):
+        parts = line.split()
+        if not parts:
+            continue
+        cues = _COMMAND_CUES.get(parts[0].lower())
+        if cues is None or not all(any(word.startswith(stems) for word in words) for stems in cues):
+            return False
+        for arg in parts[1:]:
+            if arg.lower().lstrip("@") not in words and arg.lower() not in CYCLE_TIMES:
+                return False
+    return True
+
+
+def _translate_items(batch):
+    """
+    Sends inputs that missed the parser and the cache to the model as one
+    numbered prompt, so N users cost one call against the global quota. A
+    reply that can't be split, or whose section for a request isn't grounded
+    in that request, falls back to a normal single call for the affected
+    requests. Sets each item's result, or leaves it None if every model failed.
+    """
+    if len(batch) == 1:
+        batch[0].result = _translate_with_models(batch[0].author, batch[0].text)
+        return
+    metrics.observe("nl.batch_size", len(batch))
+    leftovers = batch
+    translated = _translate_batch(batch)
+    if translated is not None:
+        model_name, sections = translated
+        leftovers = []
+        for item, section in zip(batch, sections):
+            if _grounded(item.text, section):
+                item.result = (model_name, section)
+            else:
+                leftovers.append(item)
+    if leftovers:
+        metrics.incr("nl.batch_fallbacks", len(leftovers))
+    for item in leftovers:
+        item.result = _translate_with_models(item.author, item.text)
+
+
+def _translate_batch(batch):
+    authors = sorted({item.author for item in batch})
+    prompt = "\n".join(f"[{i}] {item.text}" for i, item in enumerate(batch, 1))
+    instruction = gemini_config.SYSTEM_INSTRUCTION + gemini_config.BATCH_INSTRUCTION
+    for model_name in _ordered_models():
+        reservation = _reserve_model(authors, model_name)
+        if reservation is None:
+            continue
+        print(f"Attempting to use model: {model_name} for a batch of {len(batch)} natural language commands")
+        response_text = get_gemini_command_response(prompt, model_name, gemini_config.GEMINI_API_KEY, system_instruction=instruction)
+        if response_text is None or not response_text.strip():
+            data.release_batched_api_call(authors, model_name, reservation)
+            continue
+        sections = _split_batch_response(response_text, len(batch))
+        if sections is None:
+            print(f"Model {model_name} returned a malformed batch response; falling back to single requests.")
+            return None
+        return model_name, sections
+    return None
+
+
+def translation_cache_stats():
+    """Hit/miss counts and hit rate of the !n translation cache."""
+    return _translation_cache.stats()
+
+
+class _NaturalLanguagePool:
+    """
+    Runs !n commands on gemini_config.NL_WORKER_THREADS workers, each with its
+    own bounded queue. A user is always routed to the same worker, so their
+    commands run in the order they were sent. A worker takes everything
+    waiting in its queue, up to batch_size commands, and processes them
+    together so their model calls can share one batched prompt; a lone
+    command is processed right away.
+    """
+
+    def __init__(self, workers, queue_size, batch_size):
+        self._queues = [queue.Queue(maxsize=queue_size) for _ in range(workers)]
+        self._batch_size = batch_size
+        self._started = False
+        self._lock = threading.Lock()
+
+    def _ensure_started(self):
+        with self._lock:
+            if self._started:
+                return
+            for q in self._queues:
+                threading.Thread(target=self._worker, args=(q,), daemon=True).start()
+            self._started = True
+
+    def depth(self):
+        return sum(q.qsize() for q in self._queues)
+
+    def join(self):
+        for q in self._queues:
+            q.join()
+
+    def submit(self, author, natural_language_input):
+        """Queue a command; returns False if the user's worker is full."""
+        self._ensure_started()
+        q = self._queues[hash(data.fix_name(author)) % len(self._queues)]
+        try:
+            q.put_nowait((time.time(), author, natural_language_input))
+        except queue.Full:
+            return False
+        metrics.set_gauge("nl.queue_depth", self.depth())
+        return True
+
+    def _worker(self, q):
+        while True:
+            batch = [q.get()]
+            while len(batch) < self._batch_size:
+                try:
+                    batch.append(q.get_nowait())
+                except queue.Empty:
+                    break
+            now = time.time()
+            for enqueued_at, _, _ in batch:
+                metrics.observe("nl.queue_wait_seconds", now - enqueued_at)
+            metrics.set_gauge("nl.queue_depth", self.depth())
+            try:
+                process_natural_language_commands([(author, natural_language_input) for _, author, natural_language_input in batch])
+            except Exception as e:
+                print(f"Error processing natural language commands: {e}")
+            finally:
+                for _ in batch:
+                    q.task_done()
+
+
+_nl_pool = _NaturalLanguagePool(gemini_config.NL_WORKER_THREADS, gemini_config.NL_QUEUE_SIZE_PER_WORKER, gemini_config.NL_BATCH_MAX_SIZE)
+
+
+def wait_for_natural_language_commands():
+    """Blocks until every queued !n command has been processed."""
+    _nl_pool.join()
+
+
+def submit_natural_language_command(comment_author: str, natural_language_input: str) -> bool:
+    """
+    Queues a !n command for the worker pool. If the queue is full, the user
+    gets a "busy, try later" notification and False is returned.
+    """
+    if _nl_pool.submit(comment_author, natural_language_input):
+        metrics.incr("nl.accepted")
+        return True
+    metrics.incr("nl.rejected")
     ts = data.generate_readable_timestamp()
-    final_msg = f"{ts} - Sorry, your natural language command could not be processed at this time. All models are currently unavailable or rate-limited."
-    data.add_notification(author_name_fixed, final_msg)
-    print(f"User {author_name_fixed}: All models failed or rate-limited for NL command: '{natural_language_input}'.")
+    data.add_notification(data.fix_name(comment_author), f"{ts} - The AI is busy right now, please try your !n command again later.")
+    print(f"Natural language queue full; rejected command from {comment_author}.")
+    return False
+
+
+def metrics_logger_thread():
+    """Prints the metrics, model health and translation cache stats every METRICS_LOG_INTERVAL_SECONDS."""
+    while True:
+        time.sleep(METRICS_LOG_INTERVAL_SECONDS)
+        try:
+            print(metrics.format_snapshot())
+            for model_name, health in model_health_snapshot().items():
+                print(f"  model {model_name}: {health}")
+            print(f"  translation cache: {translation_cache_stats()}")
+        except Exception as e:
+            print(f"Error logging metrics: {e}")
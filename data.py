@@ -6,6 +6,11 @@ from filelock import FileLock
 import shutil
 import threading
 import json
+import atexit
+import gzip
+from collections import OrderedDict, deque
+import bisect
+import copy
 
 # Helper to ensure a directory exists
 
@@ -21,22 +26,50 @@ ensure_dir(BACKUP_DIR)
 BALANCE_FILE = os.path.join(DATA_DIR, "balances.txt")
 NOTIFS_DIR = os.path.join(DATA_DIR, "notifications")
 PREFS_DIR = os.path.join(DATA_DIR, "preferences")
-TRANSACTIONS_FILE = os.path.join(DATA_DIR, "transactions.txt")
+TRANSACTIONS_FILE = os.path.join(DATA_DIR, "transactions.txt")  # pre-segmentation log, adopted as the first segment
+TRANSACTIONS_DIR = os.path.join(DATA_DIR, "transactions")
+BACKUP_SEGMENTS_DIR = os.path.join(BACKUP_DIR, "transaction_segments")  # sealed segments, shared by all backups
 PROCESSED_COMMENTS_FILE = os.path.join(DATA_DIR, "processed_comments.txt")
+PROCESSED_COMMENTS_MARK_FILE = os.path.join(DATA_DIR, "processed_comments_mark.txt")
 SUBSCRIPTIONS_FILE = os.path.join(DATA_DIR, "subscriptions.txt")
 COMPANIES_FILE = os.path.join(DATA_DIR, "companies.txt")
 GEMINI_USER_API_USAGE_FILE = os.path.join(DATA_DIR, "gemini_user_api_usage.json")
 GEMINI_GLOBAL_API_USAGE_FILE = os.path.join(DATA_DIR, "gemini_global_api_usage.json")
+GEMINI_RATE_LIMITS_FILE = os.path.join(DATA_DIR, "gemini_rate_limits.json")  # replaces the two usage files above
+RATE_LIMIT_PERSIST_SECONDS = 30  # how often the in-memory Gemini usage counters are saved
 GOVERNANCE_FILE = os.path.join(DATA_DIR, "governance.json")
 ELECTION_PERIOD_SECONDS = 7 * 24 * 3600  # one week
-
-
-for subdir in [NOTIFS_DIR, PREFS_DIR]:
+STARTING_BALANCE = 100.0
+HISTORY_PAGE_SIZE = 10  # transactions per page of the history cloud request
+LEADERBOARD_SIZE = 100  # entries shown by the leaderboard cloud request
+PREFERENCES_CACHE_SIZE = 1000  # parsed preference files kept in memory
+NOTIFICATIONS_DB_FILE = os.path.join(DATA_DIR, "notifications.db")
+NOTIFICATIONS_KEEP = 50  # newest notifications kept per user
+NOTIFICATION_FLUSH_INTERVAL_SECONDS = 0.5  # queued notifications are written at least this often...
+NOTIFICATION_FLUSH_BATCH = 200  # ...or as soon as this many are queued
+TX_SEGMENT_MAX_BYTES = 4 * 1024 * 1024  # seal the active transaction segment at this size...
+TX_SEGMENT_MAX_AGE_SECONDS = 7 * 24 * 3600  # ...or once its first transaction is this old
+TX_SEALED_SEGMENT_CACHE_SIZE = 4  # decompressed sealed segments kept for history lookups
+PROCESSED_COMMENTS_KEEP = 1000  # newest comment IDs kept explicitly; older ones fall under the high-water mark
+BALANCE_LOG_FILE = os.path.join(DATA_DIR, "balances.log")
+BALANCE_COMPACT_INTERVAL_SECONDS = 10 * 60  # fold balances.log into balances.txt at least this often
+BALANCE_COMPACT_LOG_BYTES = 1024 * 1024  # ...or as soon as the log grows past this size
+# Storage engine for balances, subscriptions, companies, transactions and governance:
+# "flat" keeps the text/JSON files above, "sqlite" uses SQLITE_DB_FILE
+# (import existing flat files with `python migrate_to_sqlite.py`)
+STORAGE_BACKEND = "flat"
+SQLITE_DB_FILE = os.path.join(DATA_DIR, "eckobits.db")
+
+
+for subdir in [PREFS_DIR]:
     ensure_dir(subdir)
 
 # --- Imports for Gemini Rate Limiting (add near other imports if organizing that way)
 from collections import defaultdict
 import gemini_config # Assuming gemini_config.py is in the same directory or Python path
+import sqlite_store
+
+_sql = sqlite_store.SqliteStore(SQLITE_DB_FILE) if STORAGE_BACKEND == "sqlite" else None
 
 # --- Sanitize name, block all problematic characters
 
@@ -45,6 +78,57 @@ def fix_name(name: str) -> str:
     n = name.replace(" ", "").replace("@", "").strip().lower()
     return "".join(c for c in n if c in allowed)
 
+# --- Parsed file cache
+
+def _file_stamp(path):
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (st.st_mtime_ns, st.st_size)
+
+
+class _FileCache:
+    """
+    LRU cache of parsed file contents keyed by path. An entry is used only
+    while the file's mtime and size still match what they were when it was
+    cached, so edits by other processes are picked up on the next read.
+    Values are deep-copied in and out, so callers may mutate what they get.
+    """
+
+    def __init__(self, max_entries):
+        self._lock = threading.Lock()
+        self._max_entries = max_entries
+        self._entries = OrderedDict()
+
+    def get(self, path, loader):
+        """Return the cached contents of path, calling loader() to parse it on a miss."""
+        stamp = _file_stamp(path)
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is not None and entry[0] == stamp:
+                self._entries.move_to_end(path)
+                return copy.deepcopy(entry[1])
+        value = loader()
+        self._store(path, stamp, value)
+        return value
+
+    def put(self, path, value):
+        """Cache value as the contents just written to path. Call while still holding the file's lock."""
+        self._store(path, _file_stamp(path), value)
+
+    def _store(self, path, stamp, value):
+        value = copy.deepcopy(value)
+        with self._lock:
+            self._entries[path] = (stamp, value)
+            self._entries.move_to_end(path)
+            while len(self._entries) > self._max_entries:
+                self._entries.popitem(last=False)
+
+
+_prefs_cache = _FileCache(PREFERENCES_CACHE_SIZE)
+_file_cache = _FileCache(8)  # subscriptions.txt, companies.txt, governance.json
+
 # --- Balances Management
 
 def _balances_load():
@@ -71,60 +155,547 @@ def _balances_save(balances):
         with open(tmp_file, "w") as f:
             for user, bal in balances.items():
                 f.write(f"{user}:{round(bal, 4):.4f}\n")
+            f.flush()
+            os.fsync(f.fileno())
         os.replace(tmp_file, BALANCE_FILE)
 
 
+def _truncate_torn_tail(path):
+    """Drop a partial last line left by a crash so new appends start on a fresh line."""
+    if not os.path.exists(path):
+        return
+    with open(path, "rb+") as f:
+        content = f.read()
+        if content and not content.endswith(b"\n"):
+            f.truncate(content.rfind(b"\n") + 1)
+
+
+def _balances_replay_log(path, balances):
+    """Apply the records of a balance log on top of a loaded snapshot."""
+    if not os.path.exists(path):
+        return
+    with open(path, "r") as f:
+        for line in f:
+            # A line without its newline is a record torn by a crash mid-write
+            if not line.endswith("\n") or ":" not in line:
+                continue
+            user, bal = line.strip().split(":", 1)
+            try:
+                balances[user] = float(bal)
+            except ValueError:
+                continue
+
+
+class _BalanceLog:
+    """
+    Append-only log of balance changes with group commit.
+
+    Each record is the new balance of one account in the same "user:balance"
+    form as balances.txt, so replaying a record twice is harmless. Writers
+    append records to a pending buffer and then call sync(); whichever writer
+    finds no commit in progress writes the whole buffer with a single fsync,
+    and every writer whose records were in that batch returns together.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.rotated_path = path + ".old"
+        self._cond = threading.Condition()
+        self._pending = []
+        self._appended_seq = 0
+        self._durable_seq = 0
+        self._committing = False
+        self._file = None
+
+    def read(self):
+        """Return the balances in the snapshot with the log replayed on top."""
+        balances = _balances_load()
+        _balances_replay_log(self.rotated_path, balances)
+        _balances_replay_log(self.path, balances)
+        return balances
+
+    def load(self):
+        """Read the current balances and open the log for appending."""
+        balances = self.read()
+        _truncate_torn_tail(self.path)
+        self._file = open(self.path, "a")
+        return balances
+
+    def append(self, records):
+        with self._cond:
+            self._pending.extend(records)
+            self._appended_seq += 1
+            return self._appended_seq
+
+    def size(self):
+        try:
+            return os.path.getsize(self.path)
+        except OSError:
+            return 0
+
+    def sync(self, seq=None):
+        """Block until the record batch numbered seq (default: everything appended so far) is on disk."""
+        with self._cond:
+            if seq is None:
+                seq = self._appended_seq
+            while True:
+                if self._durable_seq >= seq:
+                    return
+                if not self._committing:
+                    break
+                self._cond.wait()
+            batch, self._pending = self._pending, []
+            batch_seq = self._appended_seq
+            self._committing = True
+        committed = False
+        try:
+            self._write(batch)
+            committed = True
+        finally:
+            with self._cond:
+                if committed:
+                    self._durable_seq = batch_seq
+                else:
+                    self._pending[:0] = batch
+                self._committing = False
+                self._cond.notify_all()
+
+    def _write(self, records):
+        if records:
+            self._file.write("".join(f"{user}:{round(bal, 4):.4f}\n" for user, bal in records))
+            self._file.flush()
+            os.fsync(self._file.fileno())
+
+    def is_empty(self):
+        with self._cond:
+            return not self._pending and self.size() == 0
+
+    def rotate(self):
+        """
+        Commit everything pending, then move the log aside and start a new one.
+        The caller must hold the ledger lock so nothing is appended meanwhile.
+        """
+        self.sync()
+        with self._cond:
+            while self._committing:
+                self._cond.wait()
+            self._file.close()
+            if os.path.exists(self.rotated_path):
+                # An earlier compaction never wrote its snapshot, so its
+                # records are only in the rotated log: append to it instead
+                # of replacing it. Replaying a record twice is harmless, so a
+                # crash before the truncate below loses nothing.
+                _truncate_torn_tail(self.rotated_path)
+                with open(self.path, "r") as src, open(self.rotated_path, "a") as dst:
+                    shutil.copyfileobj(src, dst)
+                    dst.flush()
+                    os.fsync(dst.fileno())
+                self._file = open(self.path, "w")
+            else:
+                os.replace(self.path, self.rotated_path)
+                self._file = open(self.path, "a")
+
+    def discard_rotated(self):
+        if os.path.exists(self.rotated_path):
+            os.remove(self.rotated_path)
+
+
+class _SqliteBalanceLog(_BalanceLog):
+    """Group-commits balance records into the SQLite balances table instead of a log file."""
+
+    def __init__(self, store):
+        super().__init__(BALANCE_LOG_FILE)
+        self._store = store
+
+    def load(self):
+        return self._store.load_balances()
+
+    def _write(self, records):
+        if records:
+            self._store.write_balances(records)
+
+    def size(self):
+        return 0
+
+    def is_empty(self):
+        # Every commit already lands in the table, so there is nothing to compact
+        return True
+
+
+class _Rankings:
+    """
+    Users sorted by balance (highest first, ties by name), kept in a list of
+    (-balance, user) and updated with bisect as balances change.
+
+    top_version is bumped whenever a change touches the first LEADERBOARD_SIZE
+    positions, so renderings of the top of the board can be cached against it.
+    """
+
+    def __init__(self, balances):
+        self._balances = dict(balances)
+        self._order = sorted((-bal, user) for user, bal in self._balances.items())
+        self.top_version = 0
+
+    def update(self, user, balance):
+        old = self._balances.get(user)
+        if old == balance:
+            return
+        touches_top = False
+        if old is not None:
+            index = bisect.bisect_left(self._order, (-old, user))
+            del self._order[index]
+            touches_top = index < LEADERBOARD_SIZE
+        index = bisect.bisect_left(self._order, (-balance, user))
+        self._order.insert(index, (-balance, user))
+        self._balances[user] = balance
+        if touches_top or index < LEADERBOARD_SIZE:
+            self.top_version += 1
+
+    def slice(self, offset, amount):
+        return [(user, -neg_bal) for neg_bal, user in self._order[offset:offset + amount]]
+
+    def rank(self, user):
+        balance = self._balances.get(user)
+        if balance is None:
+            return None
+        return bisect.bisect_left(self._order, (-balance, user)) + 1
+
+
+class _BalanceLedger:
+    """
+    Process-resident balances backed by a snapshot and a write-ahead log.
+
+    Reads are served from memory. Every change is appended to balances.log
+    and is durable when the writing call returns. A background compactor folds
+    the log into the balances.txt snapshot once it grows past
+    BALANCE_COMPACT_LOG_BYTES or every BALANCE_COMPACT_INTERVAL_SECONDS.
+    On startup the snapshot is loaded and the log tail replayed on top of it.
+    """
+
+    def __init__(self, log, compact_interval, compact_log_bytes):
+        self.lock = threading.RLock()
+        self._log = log
+        self._compact_lock = threading.Lock()
+        self._compact_interval = compact_interval
+        self._compact_log_bytes = compact_log_bytes
+        self._balances = None
+        self._rankings = None
+        self._compactor = None
+
+    def _ensure_loaded(self):
+        # Caller must hold self.lock
+        if self._balances is None:
+            self._balances = self._log.load()
+            self._rankings = _Rankings(self._balances)
+            self._compactor = threading.Thread(target=self._compact_loop, daemon=True)
+            self._compactor.start()
+
+    def get_or_create(self, user, starting_balance):
+        with self.lock:
+            self._ensure_loaded()
+            if user in self._balances:
+                return self._balances[user]
+            seq = self._set_locked({user: starting_balance})
+        self._log.sync(seq)
+        return starting_balance
+
+    def set(self, user, amount):
+        with self.lock:
+            self._ensure_loaded()
+            seq = self._set_locked({user: amount})
+        self._log.sync(seq)
+
+    def adjust(self, user, delta):
+        """Add delta to the user's balance unless it would go negative. Returns the new balance or None."""
+        with self.lock:
+            self._ensure_loaded()
+            balance = round(self._balances.get(user, STARTING_BALANCE), 1) + delta
+            if balance < 0:
+                return None
+            seq = self._set_locked({user: balance})
+        self._log.sync(seq)
+        return balance
+
+    def _set_locked(self, changes):
+        self._balances.update(changes)
+        for user, balance in changes.items():
+            self._rankings.update(user, balance)
+        return self._log.append(changes.items())
+
+    def apply_transfers(self, transfers):
+        """
+        Apply transfers in memory and append them to the log without waiting
+        for the commit. Returns (results, seq); pass seq to sync() once any
+        lock held around this call has been released.
+        """
+        results = []
+        changes = {}
+        with self.lock:
+            self._ensure_loaded()
+            for sender, receiver, amount in transfers:
+                sender_balance = round(self._balances.get(sender, STARTING_BALANCE), 1)
+                if sender_balance < amount:
+                    results.append(None)
+                    continue
+                self._balances[sender] = sender_balance - amount
+                receiver_balance = round(self._balances.get(receiver, STARTING_BALANCE), 1)
+                self._balances[receiver] = receiver_balance + amount
+                changes[sender] = self._balances[sender]
+                changes[receiver] = self._balances[receiver]
+                results.append((round(self._balances[sender], 1), round(self._balances[receiver], 1)))
+            for user, balance in changes.items():
+                self._rankings.update(user, balance)
+            seq = self._log.append(changes.items()) if changes else 0
+        return results, seq
+
+    def sync(self, seq):
+        self._log.sync(seq)
+
+    def snapshot(self):
+        with self.lock:
+            self._ensure_loaded()
+            return dict(self._balances)
+
+    def ranked(self, offset, amount):
+        """Return [(user, balance)] for the given slice of the balance ranking."""
+        with self.lock:
+            self._ensure_loaded()
+            return self._rankings.slice(offset, amount)
+
+    def rank(self, user):
+        with self.lock:
+            self._ensure_loaded()
+            return self._rankings.rank(user)
+
+    def top_version(self):
+        with self.lock:
+            self._ensure_loaded()
+            return self._rankings.top_version
+
+    def compact(self):
+        """Fold the log into a fresh balances.txt snapshot."""
+        with self._compact_lock:
+            with self.lock:
+                if self._balances is None or self._log.is_empty():
+                    return
+                balances = dict(self._balances)
+                self._log.rotate()
+            _balances_save(balances)
+            self._log.discard_rotated()
+
+    def _compact_loop(self):
+        last_compaction = time.time()
+        while True:
+            time.sleep(min(self._compact_interval, 30))
+            overdue = time.time() - last_compaction >= self._compact_interval
+            if self._log.size() == 0 or (not overdue and self._log.size() < self._compact_log_bytes):
+                continue
+            try:
+                self.compact()
+                last_compaction = time.time()
+            except Exception as e:
+                print(f"Error compacting balance log: {e}")
+
+
+_ledger = _BalanceLedger(
+    _SqliteBalanceLog(_sql) if _sql is not None else _BalanceLog(BALANCE_LOG_FILE),
+    BALANCE_COMPACT_INTERVAL_SECONDS,
+    BALANCE_COMPACT_LOG_BYTES,
+)
+
+
+def flush_balances():
+    """Fold the balance log into balances.txt so the snapshot alone is current."""
+    _ledger.compact()
+
+
+atexit.register(flush_balances)
+
+
 def set_balance(user, amount):
     user = fix_name(user)
     try:
         amount = float(amount)
     except ValueError:
         amount = 0.0
-    balances = _balances_load()
-    balances[user] = amount
-    _balances_save(balances)
+    _ledger.set(user, amount)
 
 
 def get_balance(user):
     user = fix_name(user)
-    balances = _balances_load()
-    if user in balances:
-        return round(balances[user], 1)
-    set_balance(user, 100.0)
-    return 100.0
+    return round(_ledger.get_or_create(user, STARTING_BALANCE), 1)
+
+
+def adjust_balance(user, amount):
+    """
+    Atomically adds amount (negative to take bits away) to the user's balance.
+    Returns the new balance, or None if it would drop below zero.
+    """
+    balance = _ledger.adjust(fix_name(user), round(float(amount), 1))
+    return None if balance is None else round(balance, 1)
+
+
+def apply_transfers(transfers):
+    """
+    Applies a batch of (sender, receiver, amount) transfers in one ledger pass.
+
+    Funds are checked, both accounts updated and the transaction records
+    appended under a single lock, so concurrent writers cannot interleave.
+    Transfers are applied in order; each is checked against the balances left
+    by the ones before it.
+
+    Returns:
+        A list with one entry per transfer: (sender_balance, receiver_balance)
+        after the transfer, or None if the sender had insufficient funds.
+    """
+    normalized = [(fix_name(sender), fix_name(receiver), round(float(amount), 1))
+                  for sender, receiver, amount in transfers]
+    with _ledger.lock:
+        results, seq = _ledger.apply_transfers(normalized)
+        applied = [t for t, result in zip(normalized, results) if result is not None]
+        if applied:
+            _append_transactions([_make_transaction(*t) for t in applied])
+    _ledger.sync(seq)
+    return results
+
+
+def transfer(sender, receiver, amount):
+    """Moves amount from sender to receiver. Returns the new (sender, receiver) balances, or None if funds are insufficient."""
+    return apply_transfers([(sender, receiver, amount)])[0]
 
 # --- Notifications Management
 
-def _notifs_file(user):
-    return os.path.join(NOTIFS_DIR, f"{user}.txt")
+_notifications = sqlite_store.NotificationStore(NOTIFICATIONS_DB_FILE, NOTIFICATIONS_KEEP)
+
+
+def _import_legacy_notifications():
+    """
+    Moves the old per-user notifications/<user>.txt files into the notification
+    store (newest NOTIFICATIONS_KEEP per user, all unread), then renames the
+    directory to notifications.imported so it is not imported again.
+    """
+    if not os.path.isdir(NOTIFS_DIR):
+        return
+    imported = []
+    for fname in sorted(os.listdir(NOTIFS_DIR)):
+        if not fname.endswith(".txt"):
+            continue
+        with open(os.path.join(NOTIFS_DIR, fname), "r") as f:
+            messages = [line.strip() for line in f if line.strip()]
+        user = fname[:-len(".txt")]
+        imported.extend((user, message) for message in messages[-NOTIFICATIONS_KEEP:])
+    if imported:
+        _notifications.add(imported)
+    os.replace(NOTIFS_DIR, NOTIFS_DIR + ".imported")
+    print(f"Imported {len(imported)} notifications from {NOTIFS_DIR}")
+
+
+_import_legacy_notifications()
+
+
+class _NotificationWriter:
+    """
+    Queues notifications in memory, grouped per user, and writes them to the
+    store from a background thread every NOTIFICATION_FLUSH_INTERVAL_SECONDS
+    or once NOTIFICATION_FLUSH_BATCH are waiting, so request threads never
+    wait on the database. Reads take the write lock and merge in whatever is
+    still queued.
+    """
+
+    def __init__(self, store, interval, batch):
+        self._store = store
+        self._interval = interval
+        self._batch = batch
+        self._cond = threading.Condition()
+        self._write_lock = threading.Lock()
+        self._pending = defaultdict(list)
+        self._pending_count = 0
+        self._thread = None
+
+    def add(self, notifications):
+        with self._cond:
+            for user, message in notifications:
+                self._pending[user].append(message)
+                self._pending_count += 1
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+            self._cond.notify()
+
+    def _take(self):
+        with self._cond:
+            pending, self._pending = self._pending, defaultdict(list)
+            self._pending_count = 0
+        return [(user, message) for user, messages in pending.items() for message in messages]
+
+    def flush(self):
+        """Write everything queued so far; returns once it is in the store."""
+        with self._write_lock:
+            notifications = self._take()
+            if notifications:
+                self._store.add(notifications)
+
+    def pending_for(self, user):
+        # Caller must hold self._write_lock
+        with self._cond:
+            return list(self._pending.get(user, ()))
+
+    def read(self, func, user):
+        """Run func(user) against the store and return it with the user's still-queued messages."""
+        with self._write_lock:
+            return func(user), self.pending_for(user)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._pending_count > 0)
+                self._cond.wait_for(lambda: self._pending_count >= self._batch, timeout=self._interval)
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Error writing notifications: {e}")
+
+
+_notification_writer = _NotificationWriter(_notifications, NOTIFICATION_FLUSH_INTERVAL_SECONDS, NOTIFICATION_FLUSH_BATCH)
+
+
+def flush_notifications():
+    """Write all queued notifications to the store."""
+    _notification_writer.flush()
+
+
+atexit.register(flush_notifications)
 
 
 def get_notifications(user):
-    user = fix_name(user)
-    notif_file = _notifs_file(user)
-    lockfile = notif_file + ".lock"
-    with FileLock(lockfile):
-        if not os.path.exists(notif_file):
-            return []
-        with open(notif_file, "r") as f:
-            return [line.strip() for line in f.readlines() if line.strip()]
+    """Return the user's notifications (at most NOTIFICATIONS_KEEP), oldest first."""
+    stored, pending = _notification_writer.read(_notifications.messages, fix_name(user))
+    return (stored + pending)[-NOTIFICATIONS_KEEP:]
+
+
+def get_unread_notifications(user):
+    """Return the notifications the user hasn't fetched yet and mark them read."""
+    flush_notifications()
+    return _notifications.read_unread(fix_name(user))
+
+
+def has_notifications(user):
+    stored, pending = _notification_writer.read(_notifications.has_messages, fix_name(user))
+    return stored or bool(pending)
 
 
 def add_notification(user, message):
-    user = fix_name(user)
-    notif_file = _notifs_file(user)
-    lockfile = notif_file + ".lock"
-    with FileLock(lockfile):
-        with open(notif_file, "a") as f:
-            f.write(message + "\n")
+    _notification_writer.add([(fix_name(user), message)])
+
+
+def add_notifications(notifications):
+    """Queues a batch of (user, message) notifications."""
+    _notification_writer.add([(fix_name(user), message) for user, message in notifications])
 
 
 def clear_notifications(user):
-    user = fix_name(user)
-    notif_file = _notifs_file(user)
-    lockfile = notif_file + ".lock"
-    with FileLock(lockfile):
-        open(notif_file, "w").close()
+    flush_notifications()
+    _notifications.clear(fix_name(user))
 
 # --- Preferences Management
 
@@ -132,50 +703,368 @@ def _prefs_file(user):
     return os.path.join(PREFS_DIR, f"{user}.txt")
 
 
+DEFAULT_PREFERENCES = {"theme": "blue", "mute": "False"}
+
+
+def _prefs_file_load(prefs_file):
+    with FileLock(prefs_file + ".lock"):
+        with open(prefs_file, "r") as f:
+            text = f.read().strip()
+    try:
+        d = json.loads(text)
+    except json.JSONDecodeError:
+        # Files written before preferences were stored as JSON
+        try:
+            d = ast.literal_eval(text)
+        except (ValueError, SyntaxError):
+            return dict(DEFAULT_PREFERENCES)
+    if not isinstance(d, dict):
+        return dict(DEFAULT_PREFERENCES)
+    for k in DEFAULT_PREFERENCES:
+        if k not in d:
+            d[k] = DEFAULT_PREFERENCES[k]
+    return d
+
+
 def get_preferences(user):
     user = fix_name(user)
     prefs_file = _prefs_file(user)
-    lockfile = prefs_file + ".lock"
-    default_prefs = {"theme": "blue", "mute": "False"}
-    with FileLock(lockfile):
-        if not os.path.exists(prefs_file):
-            set_preferences(user, default_prefs["theme"], default_prefs["mute"])
-            return default_prefs
-        with open(prefs_file, "r") as f:
-            try:
-                d = ast.literal_eval(f.read().strip())
-                if isinstance(d, dict):
-                    for k in default_prefs:
-                        if k not in d:
-                            d[k] = default_prefs[k]
-                    return d
-            except (ValueError, SyntaxError):
-                return default_prefs
-    return default_prefs
+    if not os.path.exists(prefs_file):
+        set_preferences(user, DEFAULT_PREFERENCES["theme"], DEFAULT_PREFERENCES["mute"])
+        return dict(DEFAULT_PREFERENCES)
+    return _prefs_cache.get(prefs_file, lambda: _prefs_file_load(prefs_file))
 
 
 def set_preferences(user, theme, mute):
     user = fix_name(user)
     prefs_file = _prefs_file(user)
-    lockfile = prefs_file + ".lock"
+    tmp_file = prefs_file + ".tmp"
     d = {"theme": theme, "mute": mute}
-    with FileLock(lockfile):
-        with open(prefs_file, "w") as f:
-            f.write(str(d))
+    with FileLock(prefs_file + ".lock"):
+        with open(tmp_file, "w") as f:
+            json.dump(d, f)
+        os.replace(tmp_file, prefs_file)
+        _prefs_cache.put(prefs_file, d)
 
 # --- Transactions Management
 
-def save_transaction(sender, receiver, amount):
-    tx = {
+def _make_transaction(sender, receiver, amount):
+    return {
         "timestamp": int(time.time()),
         "from": sender,
         "to": receiver,
         "amount": round(float(amount), 1)
     }
-    lockfile = TRANSACTIONS_FILE + ".lock"
-    with FileLock(lockfile):
-        with open(TRANSACTIONS_FILE, "a") as f:
-            f.write(str(tx) + "\n")
+
+
+def _parse_transaction(line):
+    try:
+        tx = ast.literal_eval(line.strip())
+    except (ValueError, SyntaxError):
+        return None
+    if isinstance(tx, dict) and all(k in tx for k in ["timestamp", "from", "to", "amount"]):
+        return tx
+    return None
+
+
+class _TransactionLog:
+    """
+    Segmented transaction log with a per-user index.
+
+    transactions/ holds numbered segments. The highest-numbered NNNNNNNN.log
+    is the active segment and the only one ever appended to. Once it reaches
+    TX_SEGMENT_MAX_BYTES or TX_SEGMENT_MAX_AGE_SECONDS it is sealed:
+    compressed to NNNNNNNN.log.gz and made read-only. Sealed segments never
+    change, so backups copy each of them only once.
+
+    index.txt holds one "segment<TAB>offset<TAB>from<TAB>to" line per
+    transaction, where offset points into the uncompressed segment. It is
+    appended together with the log, so building the per-user posting lists
+    only reads that file plus whatever the log gained after its last entry.
+    """
+
+    def __init__(self, directory, legacy_file, max_bytes, max_age):
+        self.directory = directory
+        self.legacy_file = legacy_file
+        self.index_path = os.path.join(directory, "index.txt")
+        self._lockfile = os.path.join(directory, "segments.lock")
+        self._max_bytes = max_bytes
+        self._max_age = max_age
+        self._lock = threading.Lock()
+        self._postings = None
+        self._active = None
+        self._sealed_cache = OrderedDict()
+
+    def _segment_path(self, segment, sealed=False):
+        return os.path.join(self.directory, f"{segment:08d}.log" + (".gz" if sealed else ""))
+
+    def _segments(self):
+        """Return (segment, sealed) pairs in log order."""
+        segments = {}
+        for name in os.listdir(self.directory):
+            if name.endswith(".log.gz"):
+                segments[int(name[:-len(".log.gz")])] = True
+            elif name.endswith(".log"):
+                segments.setdefault(int(name[:-len(".log")]), False)
+        return sorted(segments.items())
+
+    def _open_segment(self, segment):
+        try:
+            return open(self._segment_path(segment), "rb")
+        except FileNotFoundError:
+            # Sealed since the caller listed the segments
+            return gzip.open(self._segment_path(segment, sealed=True), "rb")
+
+    def _ensure_active(self):
+        # Caller must hold the segments file lock
+        if self._active is not None:
+            return
+        ensure_dir(self.directory)
+        segments = self._segments()
+        if not segments and os.path.exists(self.legacy_file):
+            # Adopt the pre-segmentation transactions.txt as the first segment
+            os.replace(self.legacy_file, self._segment_path(1))
+            legacy_index = os.path.splitext(self.legacy_file)[0] + ".idx"
+            if os.path.exists(legacy_index):
+                os.remove(legacy_index)
+            if os.path.exists(self.index_path):
+                os.remove(self.index_path)
+            self._write_index(self._scan_segment(1))
+            segments = self._segments()
+        for segment, sealed in segments:
+            # A crash between compressing and removing the original leaves both
+            if sealed and os.path.exists(self._segment_path(segment)):
+                os.remove(self._segment_path(segment))
+        segments = self._segments()
+        if segments and not segments[-1][1]:
+            segment = segments[-1][0]
+            path = self._segment_path(segment)
+            _truncate_torn_tail(path)
+            with open(path, "rb") as f:
+                first = _parse_transaction(f.readline().decode())
+            started = first["timestamp"] if first else time.time()
+            self._active = [segment, os.path.getsize(path), started]
+        else:
+            segment = segments[-1][0] + 1 if segments else 1
+            self._active = [segment, 0, time.time()]
+
+    def _seal(self, segment):
+        src = self._segment_path(segment)
+        dst = self._segment_path(segment, sealed=True)
+        tmp = dst + ".tmp"
+        with open(src, "rb") as fin, gzip.open(tmp, "wb") as fout:
+            shutil.copyfileobj(fin, fout)
+        os.chmod(tmp, 0o444)
+        os.replace(tmp, dst)
+        os.remove(src)
+        print(f"Sealed transaction segment {os.path.basename(dst)}")
+
+    def append(self, txs):
+        with FileLock(self._lockfile):
+            self._ensure_active()
+            segment, size, started = self._active
+            if size and (size >= self._max_bytes or time.time() - started >= self._max_age):
+                self._seal(segment)
+                segment, size, started = segment + 1, 0, time.time()
+            lines = []
+            entries = []
+            for tx in txs:
+                line = (str(tx) + "\n").encode()
+                lines.append(line)
+                entries.append((segment, size, tx["from"], tx["to"]))
+                size += len(line)
+            with open(self._segment_path(segment), "ab") as f:
+                f.write(b"".join(lines))
+            self._active = [segment, size, started]
+            self._write_index(entries)
+            with self._lock:
+                if self._postings is not None:
+                    for entry in entries:
+                        self._add(self._postings, *entry)
+
+    def iter_transactions(self):
+        """Yield every transaction in log order, streaming across segments."""
+        with FileLock(self._lockfile):
+            self._ensure_active()
+            segments = [segment for segment, _ in self._segments()]
+        for segment in segments:
+            with self._open_segment(segment) as f:
+                for line in f:
+                    tx = _parse_transaction(line.decode())
+                    if tx is not None:
+                        yield tx
+
+    # --- Per-user index
+
+    def _add(self, postings, segment, offset, sender, receiver):
+        postings[sender].append((segment, offset))
+        if receiver != sender:
+            postings[receiver].append((segment, offset))
+
+    def _write_index(self, entries):
+        if entries:
+            with open(self.index_path, "a") as f:
+                f.write("".join(f"{segment}\t{offset}\t{sender}\t{receiver}\n" for segment, offset, sender, receiver in entries))
+
+    def _scan_segment(self, segment, after=None):
+        """Return index entries for a segment's lines, or only those following the line at offset after."""
+        entries = []
+        with self._open_segment(segment) as f:
+            if after is not None:
+                f.seek(after)
+                f.readline()
+            while True:
+                offset = f.tell()
+                line = f.readline()
+                if not line:
+                    break
+                tx = _parse_transaction(line.decode())
+                if tx is not None:
+                    entries.append((segment, offset, tx["from"], tx["to"]))
+        return entries
+
+    def _ensure_index(self):
+        # Lock order matches append(): segments file lock first, then self._lock
+        if self._postings is not None:
+            return
+        with FileLock(self._lockfile):
+            self._ensure_active()
+            with self._lock:
+                if self._postings is None:
+                    self._load_index()
+
+    def _load_index(self):
+        # Caller must hold the segments file lock and self._lock
+        postings = defaultdict(list)
+        last = None
+        _truncate_torn_tail(self.index_path)
+        if os.path.exists(self.index_path):
+            with open(self.index_path, "r") as f:
+                for line in f:
+                    parts = line.rstrip("\n").split("\t")
+                    if len(parts) != 4:
+                        continue
+                    try:
+                        segment, offset = int(parts[0]), int(parts[1])
+                    except ValueError:
+                        continue
+                    self._add(postings, segment, offset, parts[2], parts[3])
+                    last = (segment, offset)
+        missing = []
+        for segment, _ in self._segments():
+            if last is None or segment > last[0]:
+                missing.extend(self._scan_segment(segment))
+            elif segment == last[0]:
+                missing.extend(self._scan_segment(segment, after=last[1]))
+        for entry in missing:
+            self._add(postings, *entry)
+        self._write_index(missing)
+        self._postings = postings
+
+    def _sealed_bytes(self, segment):
+        with self._lock:
+            if segment in self._sealed_cache:
+                self._sealed_cache.move_to_end(segment)
+                return self._sealed_cache[segment]
+        with gzip.open(self._segment_path(segment, sealed=True), "rb") as f:
+            content = f.read()
+        with self._lock:
+            self._sealed_cache[segment] = content
+            while len(self._sealed_cache) > TX_SEALED_SEGMENT_CACHE_SIZE:
+                self._sealed_cache.popitem(last=False)
+        return content
+
+    def _read_lines(self, segment, offsets):
+        try:
+            with open(self._segment_path(segment), "rb") as f:
+                lines = []
+                for offset in offsets:
+                    f.seek(offset)
+                    lines.append(f.readline())
+                return lines
+        except FileNotFoundError:
+            content = self._sealed_bytes(segment)
+            return [content[offset:content.index(b"\n", offset) + 1] for offset in offsets]
+
+    def lookup(self, user, limit, skip):
+        """Return up to limit of the user's transactions, newest first, after skipping the newest skip."""
+        self._ensure_index()
+        with self._lock:
+            postings = self._postings.get(user, [])
+            end = max(len(postings) - skip, 0)
+            page = list(reversed(postings[max(end - limit, 0):end]))
+        txs = []
+        for segment in sorted({segment for segment, _ in page}, reverse=True):
+            offsets = [offset for seg, offset in page if seg == segment]
+            for line in self._read_lines(segment, offsets):
+                tx = _parse_transaction(line.decode())
+                if tx is not None:
+                    txs.append(tx)
+        return txs
+
+    def backup(self, dest_folder, shared_segments_dir):
+        """
+        Copy the log into a backup. Sealed segments go to shared_segments_dir
+        once and are skipped by later backups; only the active segment is
+        copied into dest_folder every time. index.txt is left out: it grows
+        with the whole history, and _load_index rebuilds it from the segments
+        when it is missing.
+        """
+        ensure_dir(shared_segments_dir)
+        dest = os.path.join(dest_folder, os.path.basename(self.directory))
+        ensure_dir(dest)
+        with FileLock(self._lockfile):
+            self._ensure_active()
+            for segment, sealed in self._segments():
+                if sealed:
+                    name = os.path.basename(self._segment_path(segment, sealed=True))
+                    if not os.path.exists(os.path.join(shared_segments_dir, name)):
+                        shutil.copy2(self._segment_path(segment, sealed=True), os.path.join(shared_segments_dir, name))
+                else:
+                    shutil.copy2(self._segment_path(segment), dest)
+
+
+_tx_log = _TransactionLog(TRANSACTIONS_DIR, TRANSACTIONS_FILE, TX_SEGMENT_MAX_BYTES, TX_SEGMENT_MAX_AGE_SECONDS)
+
+
+def _append_transactions(txs):
+    if _sql is not None:
+        _sql.append_transactions(txs)
+    else:
+        _tx_log.append(txs)
+
+
+def save_transaction(sender, receiver, amount):
+    _append_transactions([_make_transaction(sender, receiver, amount)])
+
+
+def iter_transactions():
+    """Yield every recorded transaction, oldest first."""
+    if _sql is not None:
+        return _sql.iter_transactions()
+    return _tx_log.iter_transactions()
+
+
+def get_transaction_history(user, page=1, page_size=HISTORY_PAGE_SIZE):
+    """Return one page (1-based) of the user's transactions, newest first."""
+    user = fix_name(user)
+    skip = (max(int(page), 1) - 1) * page_size
+    if _sql is not None:
+        return _sql.transactions_for_user(user, page_size, skip)
+    return _tx_log.lookup(user, page_size, skip)
+
+
+def create_history(user, page=1):
+    """Render a page of the user's transaction history for the history cloud request."""
+    user = fix_name(user)
+    entries = []
+    for tx in get_transaction_history(user, page):
+        when = datetime.fromtimestamp(tx["timestamp"]).strftime("%H:%M on %m/%d/%y")
+        if tx["from"] == user:
+            entries.append(f"{when} - Sent {tx['amount']:.1f} bits to {tx['to']}")
+        else:
+            entries.append(f"{when} - Received {tx['amount']:.1f} bits from {tx['from']}")
+    return entries
 
 # --- Processed Comments Management
 
@@ -201,19 +1090,101 @@ def _processed_comments_save(processed_ids):
         os.replace(tmp_file, PROCESSED_COMMENTS_FILE)
 
 
+def _processed_comments_mark_load():
+    if not os.path.exists(PROCESSED_COMMENTS_MARK_FILE):
+        return 0
+    with open(PROCESSED_COMMENTS_MARK_FILE, "r") as f:
+        try:
+            return int(f.read().strip() or 0)
+        except ValueError:
+            return 0
+
+
+def _processed_comments_mark_save(mark):
+    tmp_file = PROCESSED_COMMENTS_MARK_FILE + ".tmp"
+    with open(tmp_file, "w") as f:
+        f.write(str(mark))
+    os.replace(tmp_file, PROCESSED_COMMENTS_MARK_FILE)
+
+
+class _ProcessedComments:
+    """
+    In-memory set of processed comment IDs, loaded once.
+
+    New IDs are appended to processed_comments.txt one line at a time. Scratch
+    comment IDs only ever grow, so once the set holds more than twice
+    PROCESSED_COMMENTS_KEEP numeric IDs, all but the newest
+    PROCESSED_COMMENTS_KEEP are dropped and replaced by a persisted high-water
+    mark: any ID at or below the mark counts as processed.
+    """
+
+    def __init__(self, keep):
+        self._lock = threading.Lock()
+        self._keep = keep
+        self._ids = None
+        self._mark = 0
+
+    def _ensure_loaded(self):
+        # Caller must hold self._lock
+        if self._ids is None:
+            self._mark = _processed_comments_mark_load()
+            self._ids = {i for i in _processed_comments_load() if i}
+
+    def contains(self, comment_id):
+        comment_id = str(comment_id)
+        with self._lock:
+            self._ensure_loaded()
+            if comment_id in self._ids:
+                return True
+            return comment_id.isdigit() and int(comment_id) <= self._mark
+
+    def add(self, comment_id):
+        comment_id = str(comment_id)
+        with self._lock:
+            self._ensure_loaded()
+            if comment_id in self._ids:
+                return
+            lockfile = PROCESSED_COMMENTS_FILE + ".lock"
+            with FileLock(lockfile):
+                with open(PROCESSED_COMMENTS_FILE, "a") as f:
+                    f.write(f"{comment_id}\n")
+                    f.flush()
+                    os.fsync(f.fileno())
+            self._ids.add(comment_id)
+            if len(self._ids) > 2 * self._keep:
+                self._prune()
+
+    def _prune(self):
+        # Caller must hold self._lock
+        numeric = sorted((int(i) for i in self._ids if i.isdigit()), reverse=True)
+        if len(numeric) <= self._keep:
+            return
+        mark = max(self._mark, numeric[self._keep])
+        # Persist the mark before dropping the IDs it covers
+        _processed_comments_mark_save(mark)
+        self._mark = mark
+        self._ids = {i for i in self._ids if not i.isdigit() or int(i) > mark}
+        _processed_comments_save(self._ids)
+
+
+_processed_comments = _ProcessedComments(PROCESSED_COMMENTS_KEEP)
+
+
 def add_processed_comment(comment_id):
-    processed_ids = _processed_comments_load()
-    processed_ids.add(str(comment_id))
-    _processed_comments_save(processed_ids)
+    _processed_comments.add(comment_id)
 
 
 def is_comment_processed(comment_id):
-    processed_ids = _processed_comments_load()
-    return str(comment_id) in processed_ids
+    return _processed_comments.contains(comment_id)
+
 
 # --- Subscriptions Management
 
-def _subscriptions_load():
+def _subscriptions_file_load():
+    return _file_cache.get(SUBSCRIPTIONS_FILE, _subscriptions_file_read)
+
+
+def _subscriptions_file_read():
     subscriptions = []
     lockfile = SUBSCRIPTIONS_FILE + ".lock"
     with FileLock(lockfile):
@@ -230,7 +1201,7 @@ def _subscriptions_load():
     return subscriptions
 
 
-def _subscriptions_save(subscriptions):
+def _subscriptions_file_save(subscriptions):
     lockfile = SUBSCRIPTIONS_FILE + ".lock"
     tmp_file = SUBSCRIPTIONS_FILE + ".tmp"
     with FileLock(lockfile):
@@ -238,11 +1209,36 @@ def _subscriptions_save(subscriptions):
             for sub in subscriptions:
                 f.write(str(sub) + "\n")
         os.replace(tmp_file, SUBSCRIPTIONS_FILE)
+        _file_cache.put(SUBSCRIPTIONS_FILE, subscriptions)
+
+
+def _subscriptions_load():
+    if _sql is not None:
+        return _sql.load_subscriptions()
+    return _subscriptions_file_load()
+
+
+def _subscriptions_save(subscriptions):
+    if _sql is not None:
+        _sql.replace_subscriptions(subscriptions)
+    else:
+        _subscriptions_file_save(subscriptions)
 
 
 def add_subscription(payer, payee, amount, cycle, last_paid_timestamp, next_payment_timestamp):
     payer = fix_name(payer)
     payee = fix_name(payee)
+    if _sql is not None:
+        _sql.upsert_subscription({
+            "payer": payer,
+            "payee": payee,
+            "amount": round(float(amount), 1),
+            "cycle": cycle,
+            "last_paid_timestamp": last_paid_timestamp,
+            "next_payment_timestamp": next_payment_timestamp
+        })
+        _notify_subscription_changes([(payer, payee)])
+        return
     subscriptions = _subscriptions_load()
     found = False
     for sub in subscriptions:
@@ -263,34 +1259,44 @@ def add_subscription(payer, payee, amount, cycle, last_paid_timestamp, next_paym
             "next_payment_timestamp": next_payment_timestamp
         })
     _subscriptions_save(subscriptions)
+    _notify_subscription_changes([(payer, payee)])
 
 
 def remove_subscription(payer, payee):
     payer = fix_name(payer)
     payee = fix_name(payee)
-    subscriptions = _subscriptions_load()
-    initial_count = len(subscriptions)
-    subscriptions = [sub for sub in subscriptions if not (sub["payer"] == payer and sub["payee"] == payee)]
-    if len(subscriptions) < initial_count:
-        _subscriptions_save(subscriptions)
-        return True
-    return False
+    if _sql is not None:
+        removed = _sql.delete_subscription(payer, payee)
+    else:
+        subscriptions = _subscriptions_load()
+        initial_count = len(subscriptions)
+        subscriptions = [sub for sub in subscriptions if not (sub["payer"] == payer and sub["payee"] == payee)]
+        removed = len(subscriptions) < initial_count
+        if removed:
+            _subscriptions_save(subscriptions)
+    if removed:
+        _notify_subscription_changes([(payer, payee)])
+    return removed
 
 
 def remove_all_subscriptions_by_payer(payer):
     payer = fix_name(payer)
-    subscriptions = _subscriptions_load()
-    initial_count = len(subscriptions)
-    removed_payees = [sub["payee"] for sub in subscriptions if sub["payer"] == payer]
-    subscriptions = [sub for sub in subscriptions if sub["payer"] != payer]
-    if len(subscriptions) < initial_count:
-        _subscriptions_save(subscriptions)
-        return removed_payees
-    return []
+    if _sql is not None:
+        removed_payees = _sql.delete_subscriptions_by_payer(payer)
+    else:
+        subscriptions = _subscriptions_load()
+        removed_payees = [sub["payee"] for sub in subscriptions if sub["payer"] == payer]
+        if removed_payees:
+            _subscriptions_save([sub for sub in subscriptions if sub["payer"] != payer])
+    if removed_payees:
+        _notify_subscription_changes([(payer, payee) for payee in removed_payees])
+    return removed_payees
 
 
 def get_subscriptions_by_payer(payer):
     payer = fix_name(payer)
+    if _sql is not None:
+        return _sql.subscriptions_by_payer(payer)
     subscriptions = _subscriptions_load()
     return [sub for sub in subscriptions if sub["payer"] == payer]
 
@@ -298,9 +1304,77 @@ def get_subscriptions_by_payer(payer):
 def get_all_subscriptions():
     return _subscriptions_load()
 
+
+def get_subscriptions(keys):
+    """Return a dict mapping each (payer, payee) key that still exists to its subscription."""
+    keys = set(keys)
+    if _sql is not None:
+        return {key: sub for key in keys for sub in [_sql.get_subscription(*key)] if sub is not None}
+    return {(sub["payer"], sub["payee"]): sub for sub in _subscriptions_load() if (sub["payer"], sub["payee"]) in keys}
+
+
+def record_subscription_payments(payments):
+    """
+    Persists settled payments given as (payer, payee, last_paid_timestamp,
+    next_payment_timestamp). Only the timestamps of those subscriptions are
+    written; a subscription removed in the meantime stays removed.
+    """
+    if not payments:
+        return
+    if _sql is not None:
+        _sql.update_subscription_timestamps(payments)
+        return
+    by_key = {(payer, payee): (last_paid, next_payment) for payer, payee, last_paid, next_payment in payments}
+    subscriptions = _subscriptions_load()
+    for sub in subscriptions:
+        timestamps = by_key.get((sub["payer"], sub["payee"]))
+        if timestamps is not None:
+            sub["last_paid_timestamp"], sub["next_payment_timestamp"] = timestamps
+    _subscriptions_save(subscriptions)
+
+
+def remove_subscriptions(keys):
+    """Removes the given (payer, payee) subscriptions in one write."""
+    keys = set(keys)
+    if not keys:
+        return
+    if _sql is not None:
+        _sql.delete_subscriptions(keys)
+        return
+    subscriptions = _subscriptions_load()
+    _subscriptions_save([sub for sub in subscriptions if (sub["payer"], sub["payee"]) not in keys])
+
+
+_subscription_changes_cond = threading.Condition()
+_subscription_changes = set()
+
+
+def _notify_subscription_changes(keys):
+    with _subscription_changes_cond:
+        _subscription_changes.update(keys)
+        _subscription_changes_cond.notify_all()
+
+
+def wait_for_subscription_changes(timeout=None):
+    """
+    Blocks until add/remove calls change the subscription schedule, or until
+    timeout seconds pass. Returns the (payer, payee) keys changed since the
+    last call; empty on timeout.
+    """
+    with _subscription_changes_cond:
+        if not _subscription_changes:
+            _subscription_changes_cond.wait(timeout)
+        changed = set(_subscription_changes)
+        _subscription_changes.clear()
+    return changed
+
 # --- Company Management
 
-def _companies_load():
+def _companies_file_load():
+    return _file_cache.get(COMPANIES_FILE, _companies_file_read)
+
+
+def _companies_file_read():
     companies = []
     lockfile = COMPANIES_FILE + ".lock"
     with FileLock(lockfile):
@@ -317,7 +1391,7 @@ def _companies_load():
     return companies
 
 
-def _companies_save(companies):
+def _companies_file_save(companies):
     lockfile = COMPANIES_FILE + ".lock"
     tmp_file = COMPANIES_FILE + ".tmp"
     with FileLock(lockfile):
@@ -325,86 +1399,178 @@ def _companies_save(companies):
             for company in companies:
                 f.write(str(company) + "\n")
         os.replace(tmp_file, COMPANIES_FILE)
+        _file_cache.put(COMPANIES_FILE, companies)
+
+
+def _companies_load():
+    if _sql is not None:
+        return _sql.load_companies()
+    return _companies_file_load()
+
+
+def _companies_save(companies):
+    if _sql is not None:
+        _sql.replace_companies(companies)
+    else:
+        _companies_file_save(companies)
+
+
+def _companies_stamp():
+    # The SQLite store is only written through this module, so write
+    # invalidation alone keeps the registry fresh there
+    if _sql is not None:
+        return None
+    return _file_stamp(COMPANIES_FILE)
+
+
+def _copy_company(company):
+    return {"name": company["name"], "founder": company["founder"], "members": list(company["members"])}
+
+
+class _CompanyRegistry:
+    """
+    Cached view of the companies with a name -> company dict and a
+    member -> company names index. Rebuilt when companies.txt changes on disk
+    (mtime/size) or after a write through add_company / add_company_member.
+    Lookups return copies, so callers can't corrupt the cache.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stamp = None
+        self._by_name = None
+        self._by_member = None
+        self._version = 0
+
+    def invalidate(self):
+        with self._lock:
+            self._by_name = None
+
+    def _current(self):
+        stamp = _companies_stamp()
+        with self._lock:
+            if self._by_name is None or stamp != self._stamp:
+                by_name = {}
+                by_member = defaultdict(list)
+                for company in _companies_load():
+                    by_name[company["name"]] = company
+                    for member in company["members"]:
+                        by_member[member].append(company["name"])
+                self._by_name, self._by_member, self._stamp = by_name, by_member, stamp
+                self._version += 1
+            return self._by_name, self._by_member
+
+    def version(self):
+        """Changes every time the registry is rebuilt."""
+        self._current()
+        return self._version
+
+    def get(self, name):
+        company = self._current()[0].get(name)
+        return _copy_company(company) if company is not None else None
+
+    def exists(self, name):
+        return name in self._current()[0]
+
+    def is_member(self, name, member):
+        company = self._current()[0].get(name)
+        return company is not None and member in company["members"]
+
+    def for_member(self, member):
+        by_name, by_member = self._current()
+        return [_copy_company(by_name[name]) for name in by_member.get(member, ())]
+
+    def all(self):
+        return [_copy_company(company) for company in self._current()[0].values()]
+
+
+_companies = _CompanyRegistry()
 
 
 def add_company(name, founder):
     name = fix_name(name)
     founder = fix_name(founder)
-    companies = _companies_load()
-    if any(c["name"] == name for c in companies):
-        return False
-    companies.append({"name": name, "founder": founder, "members": [founder]})
-    _companies_save(companies)
-    return True
+    if _sql is not None:
+        added = _sql.add_company(name, founder)
+    else:
+        companies = _companies_load()
+        added = not any(c["name"] == name for c in companies)
+        if added:
+            companies.append({"name": name, "founder": founder, "members": [founder]})
+            _companies_save(companies)
+    if added:
+        _companies.invalidate()
+    return added
 
 
 def add_company_member(company_name, username_to_add):
     company_name = fix_name(company_name)
     username_to_add = fix_name(username_to_add)
-    companies = _companies_load()
-    updated = False
-    for company in companies:
-        if company["name"] == company_name:
-            if username_to_add not in company["members"]:
-                company["members"].append(username_to_add)
-                updated = True
-            break
+    if _sql is not None:
+        updated = _sql.add_company_member(company_name, username_to_add)
+    else:
+        companies = _companies_load()
+        updated = False
+        for company in companies:
+            if company["name"] == company_name:
+                if username_to_add not in company["members"]:
+                    company["members"].append(username_to_add)
+                    updated = True
+                break
+        if updated:
+            _companies_save(companies)
     if updated:
-        _companies_save(companies)
-        return True
-    return False
+        _companies.invalidate()
+    return updated
 
 
 def is_company_member(company_name, username):
-    company_name = fix_name(company_name)
-    username = fix_name(username)
-    companies = _companies_load()
-    for company in companies:
-        if company["name"] == company_name:
-            return username in company["members"]
-    return False
+    return _companies.is_member(fix_name(company_name), fix_name(username))
 
 
 def get_company_data(company_name):
-    company_name = fix_name(company_name)
-    companies = _companies_load()
-    for company in companies:
-        if company["name"] == company_name:
-            return company
-    return None
+    return _companies.get(fix_name(company_name))
 
 
 def is_company(name):
     """Return True if the given account name belongs to a registered company."""
-    return get_company_data(name) is not None
+    return _companies.exists(fix_name(name))
 
 
 def get_companies_for_user(username):
     """Return a list of companies the given user belongs to."""
-    username = fix_name(username)
-    companies = _companies_load()
-    return [c for c in companies if username in c.get("members", [])]
+    return _companies.for_member(fix_name(username))
 
 
 def get_all_companies():
-    return _companies_load()
+    return _companies.all()
 
 # --- Leaderboard and Timestamp
 
 def get_leaderboard(amount, offset):
-    balances = _balances_load()
-    sorted_bal = sorted(balances.items(), key=lambda x: x[1], reverse=True)
-    sliced = sorted_bal[offset:offset + amount]
-    return {k: round(v, 1) for k, v in sliced}
+    return {k: round(v, 1) for k, v in _ledger.ranked(offset, amount)}
+
+
+def get_rank(user):
+    """Return the user's 1-based position on the leaderboard, or None if they have no balance yet."""
+    return _ledger.rank(fix_name(user))
+
+
+# (ranking top_version, company registry version) -> rendered leaderboard
+_leaderboard_cache = (None, None)
 
 
 def create_leaderboard():
-    top = get_leaderboard(100, 0)
-    entries = []
-    for name, bal in top.items():
-        label = f"{name} (CO)" if is_company(name) else name
-        entries.append(f"{label}: {bal:.1f}")
-    return entries
+    global _leaderboard_cache
+    key = (_ledger.top_version(), _companies.version())
+    cached_key, entries = _leaderboard_cache
+    if cached_key != key:
+        entries = []
+        for name, bal in get_leaderboard(LEADERBOARD_SIZE, 0).items():
+            label = f"{name} (CO)" if is_company(name) else name
+            entries.append(f"{label}: {bal:.1f}")
+        _leaderboard_cache = (key, entries)
+    return list(entries)
 
 
 def generate_readable_timestamp():
@@ -417,21 +1583,28 @@ def backup_every_n_minutes(n=10, max_backups=10, remote_max_backups=20):
     def backup_func():
         while True:
             try:
+                flush_balances()
+                flush_notifications()
                 timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
                 dest_folder = os.path.join(BACKUP_DIR, timestamp)
                 ensure_dir(dest_folder)
-                for fname in ["balances.txt", "transactions.txt", "processed_comments.txt", "subscriptions.txt", "companies.txt"]:
+                for fname in ["balances.txt", "balances.log", "processed_comments.txt", "processed_comments_mark.txt", "subscriptions.txt", "companies.txt"]:
                     src = os.path.join(DATA_DIR, fname)
                     if os.path.exists(src):
                         shutil.copy2(src, os.path.join(dest_folder, fname))
-                for d in ["notifications", "preferences"]:
+                if _sql is not None:
+                    _sql.backup_to(os.path.join(dest_folder, os.path.basename(SQLITE_DB_FILE)))
+                else:
+                    _tx_log.backup(dest_folder, BACKUP_SEGMENTS_DIR)
+                _notifications.backup_to(os.path.join(dest_folder, os.path.basename(NOTIFICATIONS_DB_FILE)))
+                for d in ["preferences"]:
                     src_dir = os.path.join(DATA_DIR, d)
                     if os.path.exists(src_dir):
                         dst_dir = os.path.join(dest_folder, d)
                         if os.path.exists(dst_dir):
                             shutil.rmtree(dst_dir)
                         shutil.copytree(src_dir, dst_dir)
-                backups = sorted(os.listdir(BACKUP_DIR))
+                backups = sorted(d for d in os.listdir(BACKUP_DIR) if d != os.path.basename(BACKUP_SEGMENTS_DIR))
                 if len(backups) > max_backups:
                     for to_del in backups[:-max_backups]:
                         fullpath = os.path.join(BACKUP_DIR, to_del)
@@ -463,182 +1636,331 @@ def _load_json_data(filepath, default_factory=dict):
         except (json.JSONDecodeError, FileNotFoundError): # FileNotFoundError for race condition if file deleted after check
             return default_factory()
 
-def _save_json_data(filepath, data_to_save):
-    """Helper to save JSON data to a file with locking."""
-    lockfile = filepath + ".lock"
-    tmp_file = filepath + ".tmp"
-    with FileLock(lockfile):
-        with open(tmp_file, "w") as f:
-            json.dump(data_to_save, f, indent=4)
-        os.replace(tmp_file, filepath)
 
-def _load_gemini_user_api_usage():
-    # Uses defaultdict to easily handle new users/models
-    data = _load_json_data(GEMINI_USER_API_USAGE_FILE, lambda: defaultdict(lambda: defaultdict(list)))
-    # Ensure inner structures are defaultdicts for loaded data too
-    # This conversion is a bit tricky as json load produces dicts.
-    # For simplicity, the functions using this will use .get() or check existence.
-    # A more robust way would be to recursively convert dicts to defaultdicts if needed.
-    return data
+class _SlidingWindow:
+    """
+    Call counter over the last `window` seconds, kept as [bucket_start, count]
+    buckets of `bucket` seconds. A call only drops out once its whole bucket
+    is older than the window, so the count can run slightly high but never low.
+    """
+
+    def __init__(self, window, bucket, buckets=()):
+        self.window = window
+        self.bucket = bucket
+        self.buckets = deque([list(b) for b in buckets])
+        self.total = sum(count for _, count in self.buckets)
+
+    def _expire(self, now):
+        while self.buckets and self.buckets[0][0] + self.bucket <= now - self.window:
+            self.total -= self.buckets.popleft()[1]
+
+    def count(self, now):
+        self._expire(now)
+        return self.total
+
+    def add(self, now, amount=1):
+        start = now - now % self.bucket
+        if self.buckets and self.buckets[-1][0] == start:
+            self.buckets[-1][1] += amount
+        else:
+            self.buckets.append([start, amount])
+        self.total += amount
+
+    def remove(self, at):
+        """Take back one call recorded at time `at`, if its bucket is still in the window."""
+        start = at - at % self.bucket
+        for b in reversed(self.buckets):
+            if b[0] == start:
+                if b[1] > 0:
+                    b[1] -= 1
+                    self.total -= 1
+                return
+            if b[0] < start:
+                return
+
+
+class _RateLimiter:
+    """
+    In-memory Gemini usage limits from gemini_config.RATE_LIMITS: a per-model
+    minute and 24-hour window, and a per-user hourly window for models whose
+    per-user limit is finite. Decisions never touch the disk; the counters
+    are written to GEMINI_RATE_LIMITS_FILE every RATE_LIMIT_PERSIST_SECONDS
+    and at exit.
+    """
+
+    def __init__(self, state_file, persist_interval):
+        self._lock = threading.Lock()
+        self._state_file = state_file
+        self._persist_interval = persist_interval
+        self._models = None
+        self._users = None
+        self._dirty = False
+
+    def _model_windows(self, saved=None):
+        saved = saved or {}
+        return {
+            "minute": _SlidingWindow(60, 1, saved.get("minute", ())),
+            "day": _SlidingWindow(24 * 3600, 300, saved.get("day", ())),
+        }
+
+    def _user_window(self, saved=()):
+        return _SlidingWindow(3600, 60, saved)
+
+    def _ensure_loaded(self):
+        # Caller must hold self._lock
+        if self._models is not None:
+            return
+        self._models = {}
+        self._users = {}
+        if os.path.exists(self._state_file):
+            state = _load_json_data(self._state_file)
+            for model_name, windows in state.get("models", {}).items():
+                self._models[model_name] = self._model_windows(windows)
+            for username, models in state.get("users", {}).items():
+                for model_name, buckets in models.items():
+                    self._users[(username, model_name)] = self._user_window(buckets)
+        else:
+            self._import_legacy_usage()
+        threading.Thread(target=self._persist_loop, daemon=True).start()
+
+    def _import_legacy_usage(self):
+        # Replay the timestamp lists kept by the old JSON usage files
+        now = int(time.time())
+        for model_name, timestamps in _load_json_data(GEMINI_GLOBAL_API_USAGE_FILE).items():
+            windows = self._windows_for(model_name)
+            for t in sorted(timestamps):
+                if now - t < 24 * 3600:
+                    windows["minute"].add(int(t))
+                    windows["day"].add(int(t))
+        for username, models in _load_json_data(GEMINI_USER_API_USAGE_FILE).items():
+            for model_name, timestamps in models.items():
+                recent = sorted(int(t) for t in timestamps if now - t < 3600)
+                if recent:
+                    window = self._users.setdefault((username, model_name), self._user_window())
+                    for t in recent:
+                        window.add(t)
+        self._dirty = True
+
+    def _windows_for(self, model_name):
+        windows = self._models.get(model_name)
+        if windows is None:
+            windows = self._models[model_name] = self._model_windows()
+        return windows
+
+    def _user_limited(self, model_name):
+        return gemini_config.RATE_LIMITS[model_name][0] != float('inf')
+
+    def _allowed(self, usernames, model_name, now):
+        # Caller must hold self._lock
+        user_hourly_limit, global_minute_limit, global_24_hour_limit = gemini_config.RATE_LIMITS[model_name]
+        if self._user_limited(model_name):
+            for username in usernames:
+                window = self._users.get((username, model_name))
+                if window is not None and window.count(now) >= user_hourly_limit:
+                    print(f"Debug: User {username} exceeded hourly limit for {model_name} ({window.total}/{user_hourly_limit}).")
+                    return False
+        windows = self._windows_for(model_name)
+        if windows["minute"].count(now) >= global_minute_limit:
+            print(f"Debug: Global minute limit exceeded for {model_name} ({windows['minute'].total}/{global_minute_limit}).")
+            return False
+        if windows["day"].count(now) >= global_24_hour_limit:
+            print(f"Debug: Global 24-hour limit exceeded for {model_name} ({windows['day'].total}/{global_24_hour_limit}).")
+            return False
+        return True
+
+    def _record(self, usernames, model_name, now):
+        # Caller must hold self._lock. One call counts once globally and once
+        # for each user it serves.
+        windows = self._windows_for(model_name)
+        windows["minute"].add(now)
+        windows["day"].add(now)
+        if self._user_limited(model_name):
+            for username in usernames:
+                self._users.setdefault((username, model_name), self._user_window()).add(now)
+        self._dirty = True
+
+    def check(self, usernames, model_name):
+        now = int(time.time())
+        with self._lock:
+            self._ensure_loaded()
+            return self._allowed(usernames, model_name, now)
+
+    def record(self, usernames, model_name):
+        now = int(time.time())
+        with self._lock:
+            self._ensure_loaded()
+            self._record(usernames, model_name, now)
+
+    def reserve(self, usernames, model_name):
+        now = int(time.time())
+        with self._lock:
+            self._ensure_loaded()
+            if not self._allowed(usernames, model_name, now):
+                return None
+            self._record(usernames, model_name, now)
+            return now
+
+    def release(self, usernames, model_name, reserved_at):
+        with self._lock:
+            self._ensure_loaded()
+            windows = self._windows_for(model_name)
+            windows["minute"].remove(reserved_at)
+            windows["day"].remove(reserved_at)
+            for username in usernames:
+                window = self._users.get((username, model_name))
+                if window is not None:
+                    window.remove(reserved_at)
+            self._dirty = True
+
+    def remaining(self, model_name):
+        now = int(time.time())
+        _, global_minute_limit, global_24_hour_limit = gemini_config.RATE_LIMITS[model_name]
+        with self._lock:
+            self._ensure_loaded()
+            windows = self._windows_for(model_name)
+            return min(global_minute_limit - windows["minute"].count(now),
+                       global_24_hour_limit - windows["day"].count(now))
+
+    def prune(self):
+        """Drop expired buckets and users with no calls left in their window."""
+        now = int(time.time())
+        with self._lock:
+            self._ensure_loaded()
+            dropped = False
+            for windows in self._models.values():
+                for window in windows.values():
+                    buckets = len(window.buckets)
+                    window.count(now)
+                    dropped = dropped or len(window.buckets) < buckets
+            for key in [key for key, window in self._users.items() if window.count(now) == 0]:
+                del self._users[key]
+                dropped = True
+            if dropped:
+                self._dirty = True
+
+    def persist(self):
+        with self._lock:
+            if self._models is None or not self._dirty:
+                return
+            state = {
+                "models": {model_name: {name: list(w.buckets) for name, w in windows.items()}
+                           for model_name, windows in self._models.items()},
+                "users": defaultdict(dict),
+            }
+            for (username, model_name), window in self._users.items():
+                if window.buckets:
+                    state["users"][username][model_name] = list(window.buckets)
+            self._dirty = False
+        lockfile = self._state_file + ".lock"
+        tmp_file = self._state_file + ".tmp"
+        with FileLock(lockfile):
+            with open(tmp_file, "w") as f:
+                json.dump(state, f, separators=(",", ":"))
+            os.replace(tmp_file, self._state_file)
+
+    def _persist_loop(self):
+        while True:
+            time.sleep(self._persist_interval)
+            try:
+                self.prune()
+                self.persist()
+            except Exception as e:
+                print(f"Error saving Gemini rate limits: {e}")
+
+
+_rate_limiter = _RateLimiter(GEMINI_RATE_LIMITS_FILE, RATE_LIMIT_PERSIST_SECONDS)
+atexit.register(_rate_limiter.persist)
+
+
+def _known_model(model_name):
+    if model_name not in gemini_config.RATE_LIMITS:
+        print(f"Warning: No rate limits defined for model {model_name}. Denying call.")
+        return False
+    return True
+
 
+def reserve_api_call(username: str, model_name: str):
+    """
+    Checks the rate limits and, if the call is allowed, counts it in the same
+    step so concurrent callers can't both take the last slot.
 
-def _save_gemini_user_api_usage(usage_data):
-    _save_json_data(GEMINI_USER_API_USAGE_FILE, usage_data)
+    Returns:
+        A reservation (the reservation time) to pass to release_api_call if
+        the API call ends up failing, or None if the call is not allowed.
+    """
+    return reserve_batched_api_call([username], model_name)
 
 
-def _load_gemini_global_api_usage():
-    # Uses defaultdict for new models
-    data = _load_json_data(GEMINI_GLOBAL_API_USAGE_FILE, lambda: defaultdict(list))
-    return data
+def release_api_call(username: str, model_name: str, reservation):
+    """Gives back a reservation from reserve_api_call for a call that failed."""
+    release_batched_api_call([username], model_name, reservation)
 
-def _save_gemini_global_api_usage(usage_data):
-    _save_json_data(GEMINI_GLOBAL_API_USAGE_FILE, usage_data)
+
+def reserve_batched_api_call(usernames, model_name: str):
+    """
+    Like reserve_api_call, for one API call that serves several users: it
+    counts once against the model's global limits and once against each
+    user's own limit, and only goes ahead if every user is within theirs.
+    """
+    if not _known_model(model_name):
+        return None
+    return _rate_limiter.reserve(usernames, model_name)
+
+
+def release_batched_api_call(usernames, model_name: str, reservation):
+    """Gives back a reservation from reserve_batched_api_call for a call that failed."""
+    _rate_limiter.release(usernames, model_name, reservation)
 
 
 def record_api_call(username: str, model_name: str):
     """Records an API call for rate limiting purposes."""
-    current_time = int(time.time())
-
-    # Global Usage
-    global_usage = _load_gemini_global_api_usage()
-    if model_name not in global_usage: # Should be handled by defaultdict, but explicit check is fine
-        global_usage[model_name] = []
-    global_usage[model_name].append(current_time)
-    _save_gemini_global_api_usage(global_usage)
-
-    # User-specific Usage
-    if model_name == gemini_config.MODEL_GEMINI_FLASH_PREVIEW:
-        user_usage = _load_gemini_user_api_usage()
-        # Ensure path exists for new user/model
-        if username not in user_usage:
-            user_usage[username] = defaultdict(list)
-        if model_name not in user_usage[username]: # defaultdict handles this
-            user_usage[username][model_name] = []
-        user_usage[username][model_name].append(current_time)
-        _save_gemini_user_api_usage(user_usage)
+    _rate_limiter.record([username], model_name)
 
 
 def check_rate_limits(username: str, model_name: str) -> bool:
     """Checks if an API call is within the defined rate limits."""
-    current_time = int(time.time())
-
-    limits = gemini_config.RATE_LIMITS.get(model_name)
-    if not limits:
-        print(f"Warning: No rate limits defined for model {model_name}. Denying call.")
-        return False # Or raise an error
-    user_hourly_limit, global_minute_limit, global_24_hour_limit = limits
-
-    # Load data
-    global_usage = _load_gemini_global_api_usage()
-
-    # --- Clean up old timestamps ---
-    # Global usage cleanup (older than 24 hours)
-    if model_name in global_usage:
-        global_usage[model_name] = [
-            t for t in global_usage[model_name] if current_time - t < 24 * 60 * 60
-        ]
-    # No need for 'else' global_usage[model_name]=[] as defaultdict handles it or it's already list
-
-    save_global_needed = True # Assume save is needed if we proceed
-
-    # User-specific usage cleanup & check (only for MODEL_GEMINI_FLASH_PREVIEW)
-    if model_name == gemini_config.MODEL_GEMINI_FLASH_PREVIEW:
-        user_usage = _load_gemini_user_api_usage()
-        save_user_needed = True # Assume save is needed
-
-        if username in user_usage and model_name in user_usage[username]:
-            user_usage[username][model_name] = [
-                t for t in user_usage[username][model_name] if current_time - t < 60 * 60
-            ]
-        # No need for 'else' init, defaultdict would handle, or .get below
-
-        user_calls_last_hour = len(user_usage.get(username, {}).get(model_name, []))
-        if user_calls_last_hour >= user_hourly_limit:
-            print(f"Debug: User {username} exceeded hourly limit for {model_name} ({user_calls_last_hour}/{user_hourly_limit}).")
-            _save_gemini_user_api_usage(user_usage) # Save cleaned data
-            _save_gemini_global_api_usage(global_usage) # Save potentially cleaned global data
-            return False
-        if save_user_needed: _save_gemini_user_api_usage(user_usage)
-
-
-    # --- Check Global Minute Limit ---
-    global_calls_last_minute = len([
-        t for t in global_usage.get(model_name, []) if current_time - t < 60
-    ])
-    if global_calls_last_minute >= global_minute_limit:
-        print(f"Debug: Global minute limit exceeded for {model_name} ({global_calls_last_minute}/{global_minute_limit}).")
-        if save_global_needed: _save_gemini_global_api_usage(global_usage)
+    if not _known_model(model_name):
         return False
+    return _rate_limiter.check([username], model_name)
 
-    # --- Check Global 24 Hour Limit ---
-    # global_usage[model_name] is already filtered for 24h
-    global_calls_last_24_hours = len(global_usage.get(model_name, []))
-    if global_calls_last_24_hours >= global_24_hour_limit:
-        print(f"Debug: Global 24-hour limit exceeded for {model_name} ({global_calls_last_24_hours}/{global_24_hour_limit}).")
-        if save_global_needed: _save_gemini_global_api_usage(global_usage)
-        return False
 
-    if save_global_needed: _save_gemini_global_api_usage(global_usage) # Save cleaned data if all checks passed
-    return True
+def remaining_api_calls(model_name: str):
+    """Calls the model can still take right now under its global minute and 24-hour limits."""
+    if model_name not in gemini_config.RATE_LIMITS:
+        return 0
+    return _rate_limiter.remaining(model_name)
 
 
 def cleanup_old_api_usage_data(days_to_keep=30):
-    """Cleans up API usage data older than a specified number of days to prevent indefinite file growth."""
-    current_time = int(time.time())
-    cutoff_seconds = days_to_keep * 24 * 60 * 60
-
-    # Global cleanup
-    global_usage = _load_gemini_global_api_usage()
-    modified_global = False
-    for model_name, timestamps in list(global_usage.items()): # list() for safe iteration
-        original_len = len(timestamps)
-        global_usage[model_name] = [t for t in timestamps if current_time - t < cutoff_seconds]
-        if not global_usage[model_name]:
-            del global_usage[model_name]
-        if len(global_usage.get(model_name, [])) != original_len:
-            modified_global = True
-    if modified_global:
-        _save_gemini_global_api_usage(global_usage)
-
-    # User-specific cleanup
-    user_usage = _load_gemini_user_api_usage()
-    modified_user = False
-    for username, user_models in list(user_usage.items()):
-        for model_name, timestamps in list(user_models.items()):
-            original_len = len(timestamps)
-            user_usage[username][model_name] = [t for t in timestamps if current_time - t < cutoff_seconds]
-            if not user_usage[username][model_name]:
-                del user_usage[username][model_name]
-            if len(user_usage[username].get(model_name, [])) != original_len:
-                 modified_user = True
-        if not user_usage[username]: # If user has no models left
-            del user_usage[username]
-            modified_user = True # Ensure save if user entry is removed
-
-    if modified_user:
-        _save_gemini_user_api_usage(user_usage)
-
-    if modified_global or modified_user:
-        print(f"Old API usage data (older than {days_to_keep} days) cleaned up.")
+    """Drops expired usage buckets; nothing older than 24 hours is kept, so days_to_keep is unused."""
+    _rate_limiter.prune()
 
 # --- End of Gemini API Rate Limiting Logic ---
 
 # --- Governance Management ---
 
-def _governance_load():
+def _default_governance():
+    return {
+        "positions": {"president": {"current_holder": None}},
+        "elections": {
+            "president": {
+                "start_timestamp": int(time.time()),
+                "votes": {},
+                "voters": {}
+            }
+        }
+    }
+
+
+def _governance_file_load():
+    return _file_cache.get(GOVERNANCE_FILE, _governance_file_read)
+
+
+def _governance_file_read():
     lockfile = GOVERNANCE_FILE + ".lock"
     with FileLock(lockfile):
         if not os.path.exists(GOVERNANCE_FILE):
-            default = {
-                "positions": {"president": {"current_holder": None}},
-                "elections": {
-                    "president": {
-                        "start_timestamp": int(time.time()),
-                        "votes": {},
-                        "voters": {}
-                    }
-                }
-            }
+            default = _default_governance()
             with open(GOVERNANCE_FILE, "w") as f:
                 json.dump(default, f, indent=4)
             return default
@@ -646,25 +1968,34 @@ def _governance_load():
             try:
                 return json.load(f)
             except json.JSONDecodeError:
-                return {
-                    "positions": {"president": {"current_holder": None}},
-                    "elections": {
-                        "president": {
-                            "start_timestamp": int(time.time()),
-                            "votes": {},
-                            "voters": {}
-                        }
-                    }
-                }
+                return _default_governance()
 
 
-def _governance_save(data_to_save):
+def _governance_file_save(data_to_save):
     lockfile = GOVERNANCE_FILE + ".lock"
     tmp_file = GOVERNANCE_FILE + ".tmp"
     with FileLock(lockfile):
         with open(tmp_file, "w") as f:
             json.dump(data_to_save, f, indent=4)
         os.replace(tmp_file, GOVERNANCE_FILE)
+        _file_cache.put(GOVERNANCE_FILE, data_to_save)
+
+
+def _governance_load():
+    if _sql is None:
+        return _governance_file_load()
+    gov = _sql.load_governance()
+    if gov is None:
+        gov = _default_governance()
+        _sql.save_governance(gov)
+    return gov
+
+
+def _governance_save(data_to_save):
+    if _sql is not None:
+        _sql.save_governance(data_to_save)
+    else:
+        _governance_file_save(data_to_save)
 
 
 def get_current_holder(position: str):
@@ -753,3 +2084,31 @@ def get_all_positions():
     return list(gov.get("positions", {}).keys())
 
 # --- End of Governance Management ---
+
+# --- Storage Migration ---
+
+def migrate_flat_files_to_sqlite(db_path=SQLITE_DB_FILE):
+    """
+    Imports the flat files under DATA_DIR into a SQLite database.
+
+    Intended to run once, with the server stopped, before switching
+    STORAGE_BACKEND to "sqlite". Returns a dict of imported row counts.
+    """
+    store = sqlite_store.SqliteStore(db_path)
+    if not store.is_empty():
+        raise FileExistsError(f"{db_path} already contains data; refusing to import twice.")
+    balances = _BalanceLog(BALANCE_LOG_FILE).read()
+    subscriptions = _subscriptions_file_load()
+    companies = _companies_file_load()
+    txs = list(_tx_log.iter_transactions())
+    store.write_balances(balances.items())
+    store.replace_subscriptions(subscriptions)
+    store.replace_companies(companies)
+    store.append_transactions(txs)
+    store.save_governance(_governance_file_load())
+    return {
+        "balances": len(balances),
+        "subscriptions": len(subscriptions),
+        "companies": len(companies),
+        "transactions": len(txs),
+    }
@@ -16,6 +16,58 @@ RATE_LIMITS = {
     MODEL_GEMINI_FLASH_LITE: (float('inf'), 30, 1250) # Effectively unlimited per user per hour
 }
 
+# Request timeouts in seconds. A model missing from MODEL_TIMEOUTS uses
+# DEFAULT_TIMEOUT_SECONDS.
+DEFAULT_TIMEOUT_SECONDS = 20
+MODEL_TIMEOUTS = {
+    MODEL_GEMINI_FLASH_PREVIEW: 30,
+    MODEL_GEMINI_FLASH: 15,
+    MODEL_GEMINI_FLASH_LITE: 10,
+}
+
+# Circuit breaker per model: after BREAKER_FAILURE_THRESHOLD consecutive
+# failures a model is skipped for BREAKER_COOLDOWN_SECONDS, then retried with a
+# single probe request. Latency percentiles use the last MODEL_HEALTH_WINDOW calls.
+BREAKER_FAILURE_THRESHOLD = 3
+BREAKER_COOLDOWN_SECONDS = 60
+MODEL_HEALTH_WINDOW = 50
+
+# Backend for model calls (see nl_backends.py): "gemini" for the Gemini API,
+# or "fake" for an in-process stand-in that needs no API key. The fake sleeps
+# about FAKE_BACKEND_LATENCY_SECONDS per call and fails a FAKE_BACKEND_ERROR_RATE
+# fraction of calls.
+NL_BACKEND = "gemini"
+FAKE_BACKEND_LATENCY_SECONDS = 0.5
+FAKE_BACKEND_ERROR_RATE = 0.0
+
+# Point the client at another endpoint, e.g. "http://127.0.0.1:8080" for a
+# local stub server. None uses the real Gemini API.
+GEMINI_BASE_URL = None
+
+# Worker pool for !n commands. Each user's commands always go to the same
+# worker, so they run in order. When that worker's queue is full, the command
+# is rejected with a "busy, try later" notification.
+NL_WORKER_THREADS = 3
+NL_QUEUE_SIZE_PER_WORKER = 20
+
+# A worker that finds several !n commands waiting in its queue takes up to
+# NL_BATCH_MAX_SIZE of them at once, and those that need the model are sent
+# as one numbered prompt. A lone command is sent right away. Set it to 1 to
+# send every input on its own.
+NL_BATCH_MAX_SIZE = 8
+
+# Hedged requests: if the first model hasn't answered within its
+# NL_HEDGE_PERCENTILE latency (NL_HEDGE_DEFAULT_DELAY_SECONDS before it has
+# any samples), the next model is called as well and the first valid answer
+# wins. Costs extra quota, so it is off by default.
+NL_HEDGING_ENABLED = False
+NL_HEDGE_PERCENTILE = 90
+NL_HEDGE_DEFAULT_DELAY_SECONDS = 3.0
+
+# Cache of !n translations (see translation_cache.py)
+TRANSLATION_CACHE_SIZE = 5000
+TRANSLATION_CACHE_TTL_SECONDS = 7 * 24 * 3600
+
 # System instruction for the Gemini model
 SYSTEM_INSTRUCTION = """You are an AI assistant for ECKOBits, a system that manages virtual currency called 'bits'.
 Your task is to translate natural language requests into specific ECKOBits commands.
@@ -42,6 +94,20 @@ s userB 5
 - You have access to view user balances, subscriptions, etc., to understand context if needed, but your output must still be only the command(s).
 """
 
+# Appended to SYSTEM_INSTRUCTION for batched requests
+BATCH_INSTRUCTION = """
+This message contains several independent requests from different users, each starting with a number in square brackets, e.g. `[1] send 20 bits to rothorius`.
+Translate each request on its own, using only that request's text. For every request, output its number in square brackets on its own line, followed by that request's command(s), one per line (or nothing if it maps to no command). Output every number exactly once, in order, and nothing else.
+Example input:
+[1] send 20 bits to rothorius
+[2] cancel all my subs
+Example output:
+[1]
+s rothorius 20
+[2]
+canall
+"""
+
 # Helper function to get model configurations easily (optional, but can be useful)
 def get_model_configs():
     return [
@@ -59,6 +125,9 @@ def get_model_configs():
         }
     ]
 
+def get_model_timeout(model_name):
+    return MODEL_TIMEOUTS.get(model_name, DEFAULT_TIMEOUT_SECONDS)
+
 if __name__ == '__main__':
     # Example of how to access the configurations
     print(f"API Key: {GEMINI_API_KEY}")
@@ -1,7 +1,20 @@
 import scratchattach as sa
+import functools
 import threading
 import data
 import commands
+import request_guard
+
+# Per-requester token buckets for the request handlers: (burst, refills per
+# second) by request name; REQUEST_RATE_DEFAULT covers the rest.
+REQUEST_RATE_DEFAULT = (10, 1.0)
+REQUEST_RATE_LIMITS = {
+    'leaderboard': (3, 0.2),
+    'history': (5, 0.5),
+    'give': (5, 0.5),
+    'command': (5, 0.5),
+    'vote': (3, 0.1),
+}
 
 with open('secrets/session_id.txt', 'r') as session_id_txt:
     session_id = session_id_txt.read().strip()
@@ -12,18 +25,46 @@ cloud = session.connect_cloud(project_id)
 client = cloud.requests(used_cloud_vars=['1\u200e', '2\u200e', '3\u200e', '4\u200e'])
 project = session.connect_project(project_id)
 
+_request_buckets = request_guard.TokenBuckets(REQUEST_RATE_LIMITS, REQUEST_RATE_DEFAULT)
+_single_flight = request_guard.SingleFlight()
+
+
+def guarded(coalesce=None):
+    """
+    Throttle a request handler per requester. coalesce='all' shares one
+    in-flight result between identical requests from anyone (for replies that
+    don't depend on the requester); coalesce='requester' only between
+    identical requests from the same requester. Goes below @client.request,
+    which takes the request name from the function.
+    """
+    def decorator(func):
+        name = func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            requester = data.fix_name(client.get_requester())
+            if not _request_buckets.allow(requester, name):
+                return 'too many requests, try later'
+            if coalesce is None:
+                return func(*args, **kwargs)
+            key = (name, requester if coalesce == 'requester' else None, args, tuple(sorted(kwargs.items())))
+            return _single_flight.do(key, lambda: func(*args, **kwargs))
+        return wrapper
+    return decorator
+
 
 @client.request
+@guarded(coalesce='requester')
 def balance():
     requester = data.fix_name(client.get_requester())
     bal = data.get_balance(requester)
-    notifs = data.get_notifications(requester)
-    if not notifs:
+    if not data.has_notifications(requester):
         data.add_notification(requester, 'Welcome! No new notifications.')
     return f"{bal:.1f}"
 
 
 @client.request
+@guarded(coalesce='requester')
 def get_preferences():
     requester = data.fix_name(client.get_requester())
     prefs = data.get_preferences(requester)
@@ -31,6 +72,7 @@ def get_preferences():
 
 
 @client.request
+@guarded()
 def set_preferences(theme, mute):
     requester = data.fix_name(client.get_requester())
     data.set_preferences(requester, theme, mute)
@@ -38,6 +80,7 @@ def set_preferences(theme, mute):
 
 
 @client.request
+@guarded()
 def give(amount, user):
     try:
         amount = round(float(amount), 1)
@@ -49,20 +92,18 @@ def give(amount, user):
         return 'You cannot send bits to yourself.'
     if amount <= 0:
         return 'Amount must be positive.'
-    sender_balance = data.get_balance(sender)
-    if sender_balance < amount:
+    result = data.transfer(sender, user, amount)
+    if result is None:
         return 'Insufficient balance.'
-    receiver_balance = data.get_balance(user)
-    data.set_balance(sender, sender_balance - amount)
-    data.set_balance(user, receiver_balance + amount)
+    sender_balance, _ = result
     ts = data.generate_readable_timestamp()
     data.add_notification(user, f"{ts} - {sender} gave you {amount:.1f} bits!")
     data.add_notification(sender, f"{ts} - You gave {amount:.1f} bits to {user}!")
-    data.save_transaction(sender, user, amount)
-    return f"{data.get_balance(sender):.1f}"
+    return f"{sender_balance:.1f}"
 
 
 @client.request
+@guarded(coalesce='all')
 def search(user):
     user = data.fix_name(user)
     bal = data.get_balance(user)
@@ -72,20 +113,49 @@ def search(user):
 
 
 @client.request
+@guarded(coalesce='all')
 def leaderboard():
     return data.create_leaderboard()
 
 
 @client.request
+@guarded(coalesce='requester')
+def rank():
+    requester = data.fix_name(client.get_requester())
+    position = data.get_rank(requester)
+    if position is None:
+        return 'Unranked.'
+    return str(position)
+
+
+@client.request
+@guarded(coalesce='requester')
+def history(page=1):
+    requester = data.fix_name(client.get_requester())
+    try:
+        page = int(page)
+    except ValueError:
+        return 'Invalid page.'
+    if page < 1:
+        return 'Invalid page.'
+    entries = data.create_history(requester, page)
+    if not entries:
+        return 'No transactions!'
+    return entries
+
+
+@client.request
+@guarded()
 def notifications():
     requester = data.fix_name(client.get_requester())
-    notifs = data.get_notifications(requester)
+    notifs = data.get_unread_notifications(requester)
     if not notifs:
         return 'No notifications!'
     return notifs
 
 
 @client.request
+@guarded()
 def vote(candidate):
     voter = data.fix_name(client.get_requester())
     candidate = data.fix_name(candidate)
@@ -95,16 +165,19 @@ def vote(candidate):
 
 
 @client.request
+@guarded(coalesce='all')
 def get_candidates():
     return data.get_candidates()
 
 
 @client.request
+@guarded(coalesce='all')
 def getpolitics():
     return data.get_politics()
 
 
 @client.request
+@guarded(coalesce='all')
 def getemployees(company):
     """
     Returns the list of employees (members) for a given company.
@@ -117,6 +190,7 @@ def getemployees(company):
 
 
 @client.request
+@guarded()
 def command(p1=None, p2=None, p3=None, p4=None):
     """
     Accept up to four command arguments as parameters.
@@ -132,7 +206,8 @@ def command(p1=None, p2=None, p3=None, p4=None):
     if params[0].lower().lstrip('!') == "n":
         if len(params) > 1:
             natural = " ".join(params[1:])
-            commands.process_natural_language_command(requester, natural)
+            if not commands.submit_natural_language_command(requester, natural):
+                return 'busy, try later'
     else:
         commands.process_comment_command(requester, params)
     return 'ok'
@@ -151,6 +226,8 @@ def main():
     subscription_thread.start()
     election_thread = threading.Thread(target=commands.election_thread, daemon=True)
     election_thread.start()
+    metrics_thread = threading.Thread(target=commands.metrics_logger_thread, daemon=True)
+    metrics_thread.start()
     client.start(thread=True)
 
 
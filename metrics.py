@@ -0,0 +1,66 @@
+import threading
+from collections import deque
+
+# Process-wide counters, gauges and timing samples for the background threads
+# and request handlers. Everything is kept in memory; snapshot() returns a
+# plain dict suitable for printing or returning from a request;
+# format_snapshot() renders it for the server log.
+
+TIMING_SAMPLES = 500  # most recent samples kept per timing for percentiles
+
+_lock = threading.Lock()
+_counters = {}
+_gauges = {}
+_timings = {}
+
+
+def incr(name, amount=1):
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + amount
+
+
+def set_gauge(name, value):
+    with _lock:
+        _gauges[name] = value
+
+
+def observe(name, value):
+    """Record one sample (e.g. a latency in seconds) for a timing."""
+    with _lock:
+        samples = _timings.get(name)
+        if samples is None:
+            samples = _timings[name] = deque(maxlen=TIMING_SAMPLES)
+        samples.append(value)
+
+
+def percentile_of(sorted_samples, pct):
+    """The pct-th percentile of an already sorted, non-empty list of samples."""
+    index = min(int(round(pct / 100 * (len(sorted_samples) - 1))), len(sorted_samples) - 1)
+    return sorted_samples[index]
+
+
+def snapshot():
+    with _lock:
+        timings = {name: sorted(samples) for name, samples in _timings.items() if samples}
+        result = {"counters": dict(_counters), "gauges": dict(_gauges)}
+    result["timings"] = {
+        name: {
+            "count": len(samples),
+            "p50": percentile_of(samples, 50),
+            "p95": percentile_of(samples, 95),
+            "max": samples[-1],
+        }
+        for name, samples in timings.items()
+    }
+    return result
+
+
+def format_snapshot(snap=None):
+    """Render a snapshot as a few log lines, one per counter, gauge and timing."""
+    snap = snap or snapshot()
+    lines = [f"  {name} = {value}" for name, value in sorted(snap["counters"].items())]
+    lines += [f"  {name} = {value:g}" for name, value in sorted(snap["gauges"].items())]
+    lines += [f"  {name}: n={t['count']} p50={t['p50']:g} p95={t['p95']:g} max={t['max']:g}"
+              for name, t in sorted(snap["timings"].items())]
+    return "\n".join(["Metrics:"] + lines)
+
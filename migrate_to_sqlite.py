@@ -0,0 +1,22 @@
+import sys
+import data
+
+# Imports the flat files in db_files/ into the SQLite database used when
+# data.STORAGE_BACKEND = "sqlite". Stop the server before running this.
+#
+# Usage: python migrate_to_sqlite.py [path/to/database.db]
+
+
+def main():
+    db_path = sys.argv[1] if len(sys.argv) > 1 else data.SQLITE_DB_FILE
+    try:
+        counts = data.migrate_flat_files_to_sqlite(db_path)
+    except FileExistsError as e:
+        print(f"Migration aborted: {e}")
+        sys.exit(1)
+    print(f"Imported into {db_path}: " + ", ".join(f"{n} {kind}" for kind, n in counts.items()))
+    print('Set STORAGE_BACKEND = "sqlite" in data.py to use the new database.')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,134 @@
+import threading
+import time
+from collections import deque
+
+import metrics
+
+# Per-model health for the Gemini fallback chain. Every call's outcome and
+# latency is recorded; after `failure_threshold` consecutive failures a
+# model's breaker opens and the model is skipped for `cooldown` seconds.
+# After that a single probe request is let through (half-open): success
+# closes the breaker, failure opens it for another cool-down.
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class _State:
+    def __init__(self, window):
+        self.outcomes = deque(maxlen=window)  # True for success
+        self.latencies = deque(maxlen=window)  # seconds, successful calls only
+        self.consecutive_failures = 0
+        self.breaker = CLOSED
+        self.opened_at = 0.0
+        self.probing = False
+
+
+class ModelHealth:
+    def __init__(self, failure_threshold, cooldown, window):
+        self._lock = threading.Lock()
+        self._failure_threshold = failure_threshold
+        self._cooldown = cooldown
+        self._window = window
+        self._states = {}
+
+    def _state(self, model_name):
+        # Caller must hold self._lock
+        state = self._states.get(model_name)
+        if state is None:
+            state = self._states[model_name] = _State(self._window)
+        return state
+
+    def record_success(self, model_name, latency):
+        with self._lock:
+            state = self._state(model_name)
+            state.outcomes.append(True)
+            state.latencies.append(latency)
+            state.consecutive_failures = 0
+            state.breaker = CLOSED
+            state.probing = False
+
+    def record_failure(self, model_name):
+        with self._lock:
+            state = self._state(model_name)
+            state.outcomes.append(False)
+            state.consecutive_failures += 1
+            if state.breaker == HALF_OPEN or state.consecutive_failures >= self._failure_threshold:
+                if state.breaker != OPEN:
+                    print(f"Circuit breaker opened for {model_name} after {state.consecutive_failures} consecutive failures.")
+                state.breaker = OPEN
+                state.opened_at = time.time()
+                state.probing = False
+
+    def allow(self, model_name):
+        """
+        True if a request may be sent to the model now. Once an open
+        breaker's cool-down has passed, exactly one caller gets True (the
+        probe) until its outcome is recorded.
+        """
+        with self._lock:
+            state = self._state(model_name)
+            if state.breaker == CLOSED:
+                return True
+            if state.breaker == OPEN and time.time() - state.opened_at >= self._cooldown:
+                state.breaker = HALF_OPEN
+            if state.breaker == HALF_OPEN and not state.probing:
+                state.probing = True
+                return True
+            return False
+
+    def latency(self, model_name, pct):
+        """pct-th percentile of recent successful call latencies, or None before the first success."""
+        with self._lock:
+            state = self._states.get(model_name)
+            samples = sorted(state.latencies) if state is not None else []
+        return metrics.percentile_of(samples, pct) if samples else None
+
+    def _probe_due(self, state, now):
+        # Caller must hold self._lock
+        if state.breaker == OPEN:
+            return now - state.opened_at >= self._cooldown
+        return state.breaker == HALF_OPEN and not state.probing
+
+    def order(self, model_names, remaining_quota):
+        """
+        Sort models for the next request: models with quota before those
+        without, and models whose breaker is open before their cool-down ends
+        go last. A model due for a probe goes first so it gets one; the rest
+        are sorted by p50 latency, and models without a latency sample yet
+        come after the measured ones in their configured order.
+        remaining_quota maps a model name to the calls it has left right now.
+        """
+        now = time.time()
+        quotas = {model_name: remaining_quota(model_name) for model_name in model_names}
+        with self._lock:
+            keys = {}
+            for index, model_name in enumerate(model_names):
+                state = self._states.get(model_name)
+                probe_due = state is not None and self._probe_due(state, now)
+                blocked = state is not None and state.breaker != CLOSED and not probe_due
+                samples = sorted(state.latencies) if state is not None else []
+                keys[model_name] = (
+                    quotas[model_name] <= 0,
+                    blocked,
+                    not probe_due,
+                    not samples,
+                    metrics.percentile_of(samples, 50) if samples and not probe_due else 0.0,
+                    index,
+                )
+        return sorted(model_names, key=keys.get)
+
+    def snapshot(self):
+        with self._lock:
+            result = {}
+            for model_name, state in self._states.items():
+                samples = sorted(state.latencies)
+                result[model_name] = {
+                    "breaker": state.breaker,
+                    "success_rate": sum(state.outcomes) / len(state.outcomes) if state.outcomes else None,
+                    "p50": metrics.percentile_of(samples, 50) if samples else None,
+                    "p95": metrics.percentile_of(samples, 95) if samples else None,
+                    "consecutive_failures": state.consecutive_failures,
+                }
+        return result
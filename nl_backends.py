@@ -0,0 +1,127 @@
+import random
+import re
+import threading
+import time
+
+import gemini_config
+import nl_parser
+
+# Backends that turn a !n prompt into the model's reply text. commands.py
+# only calls generate(); the backend in use is picked by
+# gemini_config.NL_BACKEND. generate() returns the reply text, or None if
+# the reply had no text, and raises on a failed call (timeout, HTTP error).
+
+
+def _response_text(response, model_name):
+    """Extracts the reply text from a generate_content response, or None if it has none."""
+    if response.candidates:
+        candidate = response.candidates[0]
+        if candidate.content and candidate.content.parts:
+            response_text = "".join(part.text for part in candidate.content.parts if hasattr(part, 'text'))
+            if response_text:
+                return response_text.strip()
+            else:
+                print(f"Warning: Gemini response candidate for {model_name} had no text in the content parts.")
+                return None
+        elif hasattr(response, 'text') and response.text: # Fallback
+             return response.text.strip()
+        else:
+            print(f"Warning: Gemini response for {model_name} has candidates but no parsable text content.")
+            return None
+    else:
+        print(f"Warning: Gemini response for {model_name} has no candidates.")
+        return None
+
+
+class GeminiBackend:
+    """The Gemini API through google-genai, with one client per API key."""
+
+    def __init__(self, base_url=None):
+        # Imported here so the fake backend works without google-genai installed
+        from google import genai
+        self._genai = genai
+        self._base_url = base_url
+        # One client per API key, shared by every thread. Each client keeps its own
+        # HTTP connection pool, so reusing it avoids a new TLS handshake per command.
+        self._clients = {}
+        self._lock = threading.Lock()
+
+    def _client(self, api_key):
+        with self._lock:
+            client = self._clients.get(api_key)
+            if client is None:
+                http_options = None
+                if self._base_url:
+                    http_options = self._genai.types.HttpOptions(base_url=self._base_url)
+                client = self._clients[api_key] = self._genai.Client(api_key=api_key, http_options=http_options)
+            return client
+
+    def generate(self, prompt, model_name, api_key, system_instruction, timeout):
+        config = self._genai.types.GenerateContentConfig(
+            system_instruction=system_instruction,
+            candidate_count=1,
+            # HttpOptions takes the timeout in milliseconds
+            http_options=self._genai.types.HttpOptions(timeout=int(timeout * 1000)),
+        )
+        response = self._client(api_key).models.generate_content(
+            model=model_name,
+            contents=[prompt],
+            config=config,
+        )
+        return _response_text(response, model_name)
+
+
+_NUMBERED_LINE = re.compile(r"^\[(\d+)\]\s*(.*)$")
+
+
+class FakeBackend:
+    """
+    In-process stand-in for load tests and benchmarks. Each call sleeps for
+    about `latency` seconds (uniformly 0.5x to 1.5x) and fails with
+    probability `error_rate`; a call slower than its timeout raises
+    TimeoutError after the timeout, like the real client. Replies come from
+    `replies` (input text -> command lines), then nl_parser, and are empty
+    otherwise. Numbered batch prompts get a numbered reply.
+    """
+
+    def __init__(self, latency=0.0, error_rate=0.0, replies=None, seed=None):
+        self._latency = latency
+        self._error_rate = error_rate
+        self._replies = {" ".join(text.lower().split()): reply for text, reply in (replies or {}).items()}
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.calls = 0
+
+    def _reply(self, text):
+        text = " ".join(text.lower().split())
+        reply = self._replies.get(text)
+        if reply is None:
+            reply = nl_parser.parse(text)
+        return reply or ""
+
+    def generate(self, prompt, model_name, api_key, system_instruction, timeout):
+        with self._lock:
+            self.calls += 1
+            delay = self._latency * self._random.uniform(0.5, 1.5)
+            failed = self._random.random() < self._error_rate
+        if delay > timeout:
+            time.sleep(timeout)
+            raise TimeoutError(f"fake backend call to {model_name} timed out after {timeout}s")
+        time.sleep(delay)
+        if failed:
+            raise RuntimeError(f"injected failure for {model_name}")
+
+        lines = prompt.strip().split("\n")
+        numbered = [_NUMBERED_LINE.match(line.strip()) for line in lines]
+        if len(lines) > 1 and all(numbered):
+            return "\n".join(f"[{match.group(1)}]\n{self._reply(match.group(2))}".rstrip() for match in numbered)
+        return self._reply(prompt) or None
+
+
+def create_backend():
+    """Build the backend named by gemini_config.NL_BACKEND."""
+    if gemini_config.NL_BACKEND == "fake":
+        return FakeBackend(gemini_config.FAKE_BACKEND_LATENCY_SECONDS, gemini_config.FAKE_BACKEND_ERROR_RATE)
+    if gemini_config.NL_BACKEND == "gemini":
+        return GeminiBackend(gemini_config.GEMINI_BASE_URL)
+    raise ValueError(f"Unknown NL_BACKEND {gemini_config.NL_BACKEND!r}; expected 'gemini' or 'fake'.")
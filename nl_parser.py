@@ -0,0 +1,122 @@
+import re
+import sys
+import time
+
+# Local parser for the most common !n phrasings. parse() returns the same
+# command lines the model would (see gemini_config.SYSTEM_INSTRUCTION), or
+# None so the input falls through to the model chain. Inputs made of several
+# clauses ("... and ...", "... then ...") are only handled if every clause
+# parses. A company command is only produced for a name that is_company()
+# accepts, and a pronoun is never taken for a username, so "plz send ..." or
+# "give me 10 bits" go to the model instead of becoming a wrong command.
+
+_NAME = r"@?(?P<{0}>[a-z0-9_-]+)"
+_AMOUNT = r"(?P<amount>\d+(?:\.\d+)?)"
+_BITS = r"(?:\s+(?:bits?|coins?))?"
+_CYCLE = r"(?P<cycle>daily|weekly|monthly)"
+
+# Never taken as a username (also used by translation_cache)
+PRONOUNS = {"i", "me", "myself", "we", "us", "ourselves", "you", "u", "yourself", "him", "her", "them", "it"}
+
+
+def _pattern(template):
+    return re.compile(
+        "^" + template.format(user=_NAME.format("user"), company=_NAME.format("company"),
+                              amount=_AMOUNT, bits=_BITS, cycle=_CYCLE) + "$"
+    )
+
+
+# (compiled pattern, format of the command line); checked in order
+_RULES = [
+    (_pattern(r"(?:cancel|stop|end)\s+all(?:\s+(?:of\s+)?my)?\s+(?:subs|subscriptions)"), "canall"),
+    (_pattern(r"(?:cancel|stop|end|unsubscribe)(?:\s+(?:my|the))?(?:\s+(?:sub|subscription))?\s+(?:to|from|with)\s+{user}"), "can {user}"),
+    (_pattern(r"(?:sub|subscribe)\s+(?:to\s+)?{user}\s+(?:for\s+)?{amount}{bits}\s+(?:a\s+|per\s+|every\s+)?{cycle}"), "sub {user} {amount} {cycle}"),
+    (_pattern(r"(?:sub|subscribe)\s+(?:to\s+)?{user}\s+{cycle}\s+(?:for\s+)?{amount}{bits}"), "sub {user} {amount} {cycle}"),
+    (_pattern(r"(?:found|start|create|make)\s+(?:a\s+|my\s+)?company(?:\s+for\s+me)?\s+with\s+{amount}{bits}"), "found {amount}"),
+    (_pattern(r"add\s+{user}\s+to\s+(?:the\s+|my\s+)?(?:company\s+)?{company}"), "add {company} {user}"),
+    (_pattern(r"(?!(?:i|we|you|u|me)\s){company}\s+(?:send|give|pay)s?\s+{amount}{bits}\s+to\s+{user}"), "sendco {company} {user} {amount}"),
+    (_pattern(r"(?:send|give|pay|transfer)\s+{amount}{bits}\s+from\s+{company}\s+to\s+{user}"), "sendco {company} {user} {amount}"),
+    (_pattern(r"(?:send|give|pay|transfer)\s+{user}\s+{amount}{bits}\s+from\s+{company}"), "sendco {company} {user} {amount}"),
+    (_pattern(r"(?:send|give|pay|transfer)\s+{amount}{bits}\s+to\s+{user}"), "s {user} {amount}"),
+    (_pattern(r"(?:send|give|pay|transfer)\s+{user}\s+{amount}{bits}"), "s {user} {amount}"),
+]
+
+_FILLER = re.compile(r"^(?:please\s+|pls\s+|can\s+(?:you|u)\s+|could\s+(?:you|u)\s+|i\s+want\s+to\s+|i'd\s+like\s+to\s+)+")
+_CLAUSE_SPLIT = re.compile(r"\s*(?:,|;|\band\s+then\b|\bthen\b|\band\b|\balso\b)\s*")
+
+
+def _parse_clause(clause, is_company):
+    clause = _FILLER.sub("", clause.strip())
+    if not clause:
+        return None
+    for pattern, command in _RULES:
+        match = pattern.match(clause)
+        if not match:
+            continue
+        fields = match.groupdict()
+        if fields.get("user") in PRONOUNS:
+            return None
+        if "company" in fields and not is_company(fields["company"]):
+            continue
+        return command.format(**fields)
+    return None
+
+
+def parse(text, is_company=lambda name: False):
+    """
+    Return newline-separated command lines for text, or None if any part of it
+    isn't recognised. is_company(name) says whether name is a registered
+    company; by default no company commands are produced.
+    """
+    text = " ".join(text.lower().split()).rstrip(".!?")
+    lines = []
+    for clause in _CLAUSE_SPLIT.split(text):
+        if not clause:
+            continue
+        line = _parse_clause(clause, is_company)
+        if line is None and lines and lines[-1].startswith("s "):
+            # "send 10 bits to a and 5 bits to b": the verb carries over
+            line = _parse_clause("send " + clause, is_company)
+        if line is None:
+            return None
+        lines.append(line)
+    return "\n".join(lines) or None
+
+
+_BENCHMARK_INPUTS = [
+    "send 20 bits to rothorius",
+    "subscribe to trump for 10 bits weekly",
+    "cancel my subscription to rothorius",
+    "cancel all my subs",
+    "start a company with 100 bits",
+    "add rothorius to mycompany",
+    "mycompany send 50 bits to trump",
+    "please cancel all of my subscriptions and then found a company for me with 500 bits",
+    "can u sub to userA for 10 daily and also send userB 25 bits from mycompany",
+    "send 10 bits to userA and 5 bits to userB",
+    "what is my balance?",
+    # Must fall through to the model: not a company, or a pronoun as recipient
+    "plz send 10 bits to bob",
+    "just send 5 bits to bob",
+    "now give 5 bits to alice",
+    "yo send 3 to bob",
+    "give me 10 bits",
+    "send 10 bits to me",
+]
+
+_BENCHMARK_COMPANIES = {"mycompany"}
+
+
+if __name__ == "__main__":
+    rounds = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    for text in _BENCHMARK_INPUTS:
+        print(f"{text!r} -> {parse(text, _BENCHMARK_COMPANIES.__contains__)!r}")
+    started = time.perf_counter()
+    for _ in range(rounds):
+        for text in _BENCHMARK_INPUTS:
+            parse(text, _BENCHMARK_COMPANIES.__contains__)
+    elapsed = time.perf_counter() - started
+    calls = rounds * len(_BENCHMARK_INPUTS)
+    matched = sum(parse(text, _BENCHMARK_COMPANIES.__contains__) is not None for text in _BENCHMARK_INPUTS)
+    print(f"{calls} parses in {elapsed:.3f}s ({elapsed / calls * 1e6:.1f} us/parse); "
+          f"{matched}/{len(_BENCHMARK_INPUTS)} sample inputs handled locally")
@@ -0,0 +1,97 @@
+import threading
+import time
+
+import metrics
+
+# Protection for the cloud request handlers: a token bucket per requester and
+# request type, so one client polling in a loop can't monopolise the data
+# layer, and single-flight coalescing, so identical read requests that arrive
+# while one is already being computed wait for that result instead of
+# computing it again.
+
+PRUNE_EVERY = 1000  # drop idle buckets after this many allow() calls
+
+
+class TokenBuckets:
+    def __init__(self, limits, default):
+        """limits maps a request type to (burst, tokens per second); other types use default."""
+        self._lock = threading.Lock()
+        self._limits = limits
+        self._default = default
+        self._buckets = {}  # (requester, request type) -> [tokens, last refill time]
+        self._calls = 0
+
+    def allow(self, requester, request_type):
+        """Take a token for this requester and request type; False if the bucket is empty."""
+        burst, rate = self._limits.get(request_type, self._default)
+        now = time.monotonic()
+        key = (requester, request_type)
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = [burst, now]
+            else:
+                bucket[0] = min(burst, bucket[0] + (now - bucket[1]) * rate)
+                bucket[1] = now
+            if bucket[0] < 1:
+                throttled = True
+            else:
+                bucket[0] -= 1
+                throttled = False
+            self._calls += 1
+            if self._calls >= PRUNE_EVERY:
+                self._prune(now)
+        if throttled:
+            metrics.incr("requests.throttled")
+            metrics.incr(f"requests.throttled.{request_type}")
+            return False
+        return True
+
+    def _prune(self, now):
+        # Caller must hold self._lock. A bucket idle long enough to have
+        # refilled is the same as no bucket at all.
+        self._calls = 0
+        for key, (tokens, last) in list(self._buckets.items()):
+            burst, rate = self._limits.get(key[1], self._default)
+            if tokens + (now - last) * rate >= burst:
+                del self._buckets[key]
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, func):
+        """
+        Run func() unless a call with the same key is already running, in
+        which case wait for it and return its result (or raise its error).
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+        if not leader:
+            metrics.incr("requests.coalesced")
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+        try:
+            call.result = func()
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result
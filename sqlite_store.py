@@ -0,0 +1,312 @@
+import sqlite3
+import threading
+import json
+
+# SQLite storage engine used by data.py when STORAGE_BACKEND = "sqlite", plus
+# the notification store, which data.py always keeps in its own database.
+# One connection is opened per thread; WAL mode lets readers run alongside the
+# single writer, and the connect timeout makes writers queue instead of failing.
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS balances (
+    user TEXT PRIMARY KEY,
+    balance REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS subscriptions (
+    payer TEXT NOT NULL,
+    payee TEXT NOT NULL,
+    amount REAL NOT NULL,
+    cycle TEXT NOT NULL,
+    last_paid_timestamp NUMERIC NOT NULL,
+    next_payment_timestamp NUMERIC NOT NULL,
+    PRIMARY KEY (payer, payee)
+);
+CREATE INDEX IF NOT EXISTS idx_subscriptions_payee ON subscriptions (payee);
+CREATE INDEX IF NOT EXISTS idx_subscriptions_next_payment ON subscriptions (next_payment_timestamp);
+CREATE TABLE IF NOT EXISTS companies (
+    name TEXT PRIMARY KEY,
+    founder TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS company_members (
+    company TEXT NOT NULL,
+    member TEXT NOT NULL,
+    PRIMARY KEY (company, member)
+);
+CREATE INDEX IF NOT EXISTS idx_company_members_member ON company_members (member);
+CREATE TABLE IF NOT EXISTS transactions (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    timestamp INTEGER NOT NULL,
+    sender TEXT NOT NULL,
+    receiver TEXT NOT NULL,
+    amount REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_transactions_sender ON transactions (sender, id);
+CREATE INDEX IF NOT EXISTS idx_transactions_receiver ON transactions (receiver, id);
+CREATE TABLE IF NOT EXISTS governance (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    data TEXT NOT NULL
+);
+"""
+
+NOTIFICATIONS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS notifications (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user TEXT NOT NULL,
+    message TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_notifications_user ON notifications (user, id);
+CREATE TABLE IF NOT EXISTS notification_cursors (
+    user TEXT PRIMARY KEY,
+    last_read_id INTEGER NOT NULL
+);
+"""
+
+SUBSCRIPTION_COLUMNS = ["payer", "payee", "amount", "cycle", "last_paid_timestamp", "next_payment_timestamp"]
+
+
+class _SqliteDatabase:
+    schema = ""
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._local = threading.local()
+        self._conn().executescript(self.schema)
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _transaction(self):
+        return _Transaction(self._conn())
+
+    def _query(self, sql, params=()):
+        return self._conn().execute(sql, params).fetchall()
+
+    def backup_to(self, dest_path):
+        """Write a consistent copy of the database to dest_path."""
+        dest = sqlite3.connect(dest_path)
+        try:
+            self._conn().backup(dest)
+        finally:
+            dest.close()
+
+
+class SqliteStore(_SqliteDatabase):
+    schema = SCHEMA
+
+    # --- Balances
+
+    def load_balances(self):
+        return {user: balance for user, balance in self._query("SELECT user, balance FROM balances")}
+
+    def write_balances(self, records):
+        with self._transaction() as conn:
+            conn.executemany(
+                "INSERT INTO balances (user, balance) VALUES (?, ?) "
+                "ON CONFLICT (user) DO UPDATE SET balance = excluded.balance",
+                [(user, round(bal, 4)) for user, bal in records],
+            )
+
+    # --- Subscriptions
+
+    def _subscriptions(self, where="", params=()):
+        rows = self._query(f"SELECT {', '.join(SUBSCRIPTION_COLUMNS)} FROM subscriptions {where} ORDER BY rowid", params)
+        return [dict(zip(SUBSCRIPTION_COLUMNS, row)) for row in rows]
+
+    def load_subscriptions(self):
+        return self._subscriptions()
+
+    def subscriptions_by_payer(self, payer):
+        return self._subscriptions("WHERE payer = ?", (payer,))
+
+    def replace_subscriptions(self, subscriptions):
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM subscriptions")
+            conn.executemany(
+                f"INSERT INTO subscriptions ({', '.join(SUBSCRIPTION_COLUMNS)}) VALUES (?, ?, ?, ?, ?, ?)",
+                [tuple(sub[k] for k in SUBSCRIPTION_COLUMNS) for sub in subscriptions],
+            )
+
+    def upsert_subscription(self, sub):
+        with self._transaction() as conn:
+            conn.execute(
+                f"INSERT INTO subscriptions ({', '.join(SUBSCRIPTION_COLUMNS)}) VALUES (?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (payer, payee) DO UPDATE SET amount = excluded.amount, cycle = excluded.cycle, "
+                "last_paid_timestamp = excluded.last_paid_timestamp, next_payment_timestamp = excluded.next_payment_timestamp",
+                tuple(sub[k] for k in SUBSCRIPTION_COLUMNS),
+            )
+
+    def get_subscription(self, payer, payee):
+        subs = self._subscriptions("WHERE payer = ? AND payee = ?", (payer, payee))
+        return subs[0] if subs else None
+
+    def update_subscription_timestamps(self, payments):
+        with self._transaction() as conn:
+            conn.executemany(
+                "UPDATE subscriptions SET last_paid_timestamp = ?, next_payment_timestamp = ? WHERE payer = ? AND payee = ?",
+                [(last_paid, next_payment, payer, payee) for payer, payee, last_paid, next_payment in payments],
+            )
+
+    def delete_subscriptions(self, keys):
+        with self._transaction() as conn:
+            conn.executemany("DELETE FROM subscriptions WHERE payer = ? AND payee = ?", list(keys))
+
+    def delete_subscription(self, payer, payee):
+        with self._transaction() as conn:
+            return conn.execute("DELETE FROM subscriptions WHERE payer = ? AND payee = ?", (payer, payee)).rowcount > 0
+
+    def delete_subscriptions_by_payer(self, payer):
+        with self._transaction() as conn:
+            payees = [row[0] for row in conn.execute("SELECT payee FROM subscriptions WHERE payer = ? ORDER BY rowid", (payer,))]
+            conn.execute("DELETE FROM subscriptions WHERE payer = ?", (payer,))
+        return payees
+
+    # --- Companies
+
+    def _company(self, name, founder):
+        members = [row[0] for row in self._query("SELECT member FROM company_members WHERE company = ? ORDER BY rowid", (name,))]
+        return {"name": name, "founder": founder, "members": members}
+
+    def load_companies(self):
+        return [self._company(name, founder) for name, founder in self._query("SELECT name, founder FROM companies ORDER BY rowid")]
+
+    def add_company(self, name, founder):
+        with self._transaction() as conn:
+            if conn.execute("SELECT 1 FROM companies WHERE name = ?", (name,)).fetchone():
+                return False
+            conn.execute("INSERT INTO companies (name, founder) VALUES (?, ?)", (name, founder))
+            conn.execute("INSERT INTO company_members (company, member) VALUES (?, ?)", (name, founder))
+        return True
+
+    def add_company_member(self, name, member):
+        with self._transaction() as conn:
+            if not conn.execute("SELECT 1 FROM companies WHERE name = ?", (name,)).fetchone():
+                return False
+            return conn.execute(
+                "INSERT OR IGNORE INTO company_members (company, member) VALUES (?, ?)", (name, member)
+            ).rowcount > 0
+
+    def replace_companies(self, companies):
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM company_members")
+            conn.execute("DELETE FROM companies")
+            for company in companies:
+                conn.execute("INSERT INTO companies (name, founder) VALUES (?, ?)", (company["name"], company["founder"]))
+                conn.executemany(
+                    "INSERT OR IGNORE INTO company_members (company, member) VALUES (?, ?)",
+                    [(company["name"], member) for member in company["members"]],
+                )
+
+    # --- Transactions
+
+    def append_transactions(self, txs):
+        with self._transaction() as conn:
+            conn.executemany(
+                "INSERT INTO transactions (timestamp, sender, receiver, amount) VALUES (?, ?, ?, ?)",
+                [(tx["timestamp"], tx["from"], tx["to"], tx["amount"]) for tx in txs],
+            )
+
+    def iter_transactions(self):
+        cursor = self._conn().execute("SELECT timestamp, sender, receiver, amount FROM transactions ORDER BY id")
+        for ts, sender, receiver, amount in cursor:
+            yield {"timestamp": ts, "from": sender, "to": receiver, "amount": amount}
+
+    def transactions_for_user(self, user, limit, skip):
+        rows = self._query(
+            "SELECT timestamp, sender, receiver, amount FROM transactions "
+            "WHERE sender = ? OR receiver = ? ORDER BY id DESC LIMIT ? OFFSET ?",
+            (user, user, limit, skip),
+        )
+        return [{"timestamp": ts, "from": sender, "to": receiver, "amount": amount} for ts, sender, receiver, amount in rows]
+
+    # --- Governance
+
+    def load_governance(self):
+        rows = self._query("SELECT data FROM governance WHERE id = 1")
+        return json.loads(rows[0][0]) if rows else None
+
+    def save_governance(self, gov):
+        with self._transaction() as conn:
+            conn.execute(
+                "INSERT INTO governance (id, data) VALUES (1, ?) ON CONFLICT (id) DO UPDATE SET data = excluded.data",
+                (json.dumps(gov),),
+            )
+
+    # --- Maintenance
+
+    def is_empty(self):
+        return not self._query("SELECT 1 FROM balances LIMIT 1") and not self._query("SELECT 1 FROM transactions LIMIT 1")
+
+
+class NotificationStore(_SqliteDatabase):
+    """
+    Notifications for every user in one database. Each user keeps only their
+    newest `keep` messages, and a per-user cursor records the newest one read.
+    """
+
+    schema = NOTIFICATIONS_SCHEMA
+
+    def __init__(self, db_path, keep):
+        self.keep = keep
+        super().__init__(db_path)
+
+    def add(self, notifications):
+        """Append (user, message) pairs and trim each touched user back to `keep` messages."""
+        with self._transaction() as conn:
+            conn.executemany("INSERT INTO notifications (user, message) VALUES (?, ?)", notifications)
+            for user in {user for user, _ in notifications}:
+                conn.execute(
+                    "DELETE FROM notifications WHERE user = ? AND id <= "
+                    "(SELECT id FROM notifications WHERE user = ? ORDER BY id DESC LIMIT 1 OFFSET ?)",
+                    (user, user, self.keep),
+                )
+
+    def messages(self, user):
+        return [row[0] for row in self._query("SELECT message FROM notifications WHERE user = ? ORDER BY id", (user,))]
+
+    def has_messages(self, user):
+        return bool(self._query("SELECT 1 FROM notifications WHERE user = ? LIMIT 1", (user,)))
+
+    def read_unread(self, user):
+        """Return the user's unread messages, oldest first, and move their cursor past them."""
+        with self._transaction() as conn:
+            row = conn.execute("SELECT last_read_id FROM notification_cursors WHERE user = ?", (user,)).fetchone()
+            rows = conn.execute(
+                "SELECT id, message FROM notifications WHERE user = ? AND id > ? ORDER BY id",
+                (user, row[0] if row else 0),
+            ).fetchall()
+            if rows:
+                conn.execute(
+                    "INSERT INTO notification_cursors (user, last_read_id) VALUES (?, ?) "
+                    "ON CONFLICT (user) DO UPDATE SET last_read_id = excluded.last_read_id",
+                    (user, rows[-1][0]),
+                )
+        return [message for _, message in rows]
+
+    def clear(self, user):
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM notifications WHERE user = ?", (user,))
+            conn.execute("DELETE FROM notification_cursors WHERE user = ?", (user,))
+
+
+class _Transaction:
+    """Context manager running a block inside BEGIN IMMEDIATE ... COMMIT."""
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        self.conn.execute("BEGIN IMMEDIATE")
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.conn.execute("COMMIT")
+        else:
+            self.conn.execute("ROLLBACK")
+        return False
@@ -0,0 +1,172 @@
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import metrics
+import nl_parser
+
+# Cache of !n translations keyed by the shape of the input. When a model
+# reply is stored, every input token that the reply copies verbatim (usernames,
+# amounts, cycle names) becomes a slot, so "send 10 bits to bob" and
+# "send 25 bits to alice" share one entry and the reply is rebuilt from the
+# new input's tokens. Tokens that are not slots must match exactly. A slot
+# filled by a number only matches numbers and vice versa, so an amount can't
+# land where a username was. Replies with a pronoun argument aren't cached
+# and a pronoun never fills a slot (see nl_parser.PRONOUNS).
+
+SAVE_INTERVAL_SECONDS = 60  # at most one write of the cache file per interval
+
+_PUNCTUATION = ",.!?;:\"'"
+
+
+def _tokenize(text):
+    tokens = []
+    for word in text.lower().split():
+        word = word.strip(_PUNCTUATION).lstrip("@")
+        if word:
+            tokens.append(word)
+    return tokens
+
+
+def _is_number(token):
+    try:
+        float(token)
+    except ValueError:
+        return False
+    return True
+
+
+def _key(tokens, slots):
+    return " ".join(("\x01" if _is_number(tok) else "\x00") if i in slots else tok for i, tok in enumerate(tokens))
+
+
+def _template(tokens, reply):
+    """
+    Turn reply lines into [[literal or slot index, ...], ...], or None if the
+    reply can't be expressed safely in terms of the input (a copied token
+    appears more than once in the input, so its slot would be ambiguous, or
+    an argument is a pronoun).
+    """
+    positions = {}
+    for i, tok in enumerate(tokens):
+        positions.setdefault(tok, []).append(i)
+    lines = []
+    for line in reply.strip().split("\n"):
+        words = line.strip().split()
+        if not words:
+            continue
+        parts = [words[0]]
+        for word in words[1:]:
+            if word.lower().lstrip("@") in nl_parser.PRONOUNS:
+                return None
+            found = positions.get(word.lower().lstrip("@"), [])
+            if len(found) > 1:
+                return None
+            parts.append(found[0] if found else word)
+        lines.append(parts)
+    return lines or None
+
+
+def _render(template, tokens):
+    return "\n".join(" ".join(tokens[p] if isinstance(p, int) else p for p in parts) for parts in template)
+
+
+class TranslationCache:
+    def __init__(self, path, max_entries, ttl_seconds):
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()
+        self._path = path
+        self._max_entries = max_entries
+        self._ttl = ttl_seconds
+        self._entries = None  # key -> (stored_at, token_count, slots, template)
+        self._slot_sets = {}  # token count -> set of slot frozensets seen for that length
+        self._dirty = False
+        self._last_save = 0
+        self.hits = 0
+        self.misses = 0
+
+    def _ensure_loaded(self):
+        # Caller must hold self._lock
+        if self._entries is not None:
+            return
+        self._entries = OrderedDict()
+        if os.path.exists(self._path):
+            try:
+                with open(self._path, "r") as f:
+                    saved = json.load(f)
+            except (json.JSONDecodeError, OSError):
+                saved = []
+            for key, stored_at, token_count, slots, template in saved:
+                self._add(key, stored_at, token_count, frozenset(slots), template)
+
+    def _add(self, key, stored_at, token_count, slots, template):
+        self._entries[key] = (stored_at, token_count, slots, template)
+        self._entries.move_to_end(key)
+        self._slot_sets.setdefault(token_count, set()).add(slots)
+        while len(self._entries) > self._max_entries:
+            self._entries.popitem(last=False)
+
+    def lookup(self, text):
+        """Return the cached command lines for text, or None on a miss."""
+        tokens = _tokenize(text)
+        now = time.time()
+        with self._lock:
+            self._ensure_loaded()
+            for slots in self._slot_sets.get(len(tokens), ()):
+                if any(tokens[i] in nl_parser.PRONOUNS for i in slots):
+                    continue
+                key = _key(tokens, slots)
+                entry = self._entries.get(key)
+                if entry is None:
+                    continue
+                if now - entry[0] > self._ttl:
+                    del self._entries[key]
+                    self._dirty = True
+                    continue
+                self._entries.move_to_end(key)
+                self.hits += 1
+                metrics.incr("nl_cache.hits")
+                return _render(entry[3], tokens)
+            self.misses += 1
+            metrics.incr("nl_cache.misses")
+            return None
+
+    def store(self, text, reply):
+        tokens = _tokenize(text)
+        template = _template(tokens, reply)
+        if template is None:
+            return
+        slots = frozenset(p for parts in template for p in parts if isinstance(p, int))
+        with self._lock:
+            self._ensure_loaded()
+            self._add(_key(tokens, slots), time.time(), len(tokens), slots, template)
+            self._dirty = True
+            save_due = time.time() - self._last_save >= SAVE_INTERVAL_SECONDS
+        if save_due:
+            self.save()
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._entries or ()),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+            }
+
+    def save(self):
+        with self._lock:
+            if not self._dirty:
+                return
+            saved = [[key, stored_at, token_count, sorted(slots), template]
+                     for key, (stored_at, token_count, slots, template) in self._entries.items()]
+            self._dirty = False
+            self._last_save = time.time()
+        tmp_file = self._path + ".tmp"
+        with self._save_lock:
+            with open(tmp_file, "w") as f:
+                json.dump(saved, f, separators=(",", ":"))
+            os.replace(tmp_file, self._path)